@@ -0,0 +1,367 @@
+"""Cart service - changes of user's cart (OrderItem objects and Cart totals).
+
+Every change of the database cart is applied in one transaction with SQL
+statements that update rows in place (no read-modify-write in Python),
+so concurrent changes of the same cart do not lose updates. Functions
+return new totals of the cart.
+
+Views use a cart store (CART_STORE setting, see get_cart_store) - either
+the database cart directly (DatabaseCartStore) or a cart kept in session
+and written to the database later (SessionCartStore). Changes of a session
+cart are merged into the database cart (see merge_lines), so changes made
+in other sessions of the user (or by placing an order) are not lost.
+"""
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+
+from .models import Cart, OrderItem, ProductInventory, SessionCart
+
+ORDER_ITEM_TABLE = OrderItem._meta.db_table
+CART_TABLE = Cart._meta.db_table
+PRODUCT_INVENTORY_TABLE = ProductInventory._meta.db_table
+
+CartTotals = namedtuple('CartTotals', ['quantity', 'total_amount'])
+CartLine = namedtuple('CartLine', ['product_inventory_id', 'sku', 'quantity', 'price', 'amount'])
+
+# key of cart data in session
+SESSION_CART_KEY = 'cart'
+# key of cart totals in session (of DatabaseCartStore)
+SESSION_CART_TOTALS_KEY = 'cart_totals'
+# changed session cart is marked (SessionCart.marked_at) at most once per this number of seconds
+MARK_INTERVAL = 60
+
+# adds OrderItem (or increments its quantity and amount) and updates cart totals by its price
+ADD_TO_CART_SQL = f"""
+    WITH item AS (
+        INSERT INTO {ORDER_ITEM_TABLE} (user_id, cart_id, product_inventory_id, quantity, price, amount)
+        VALUES (%(user_id)s, %(cart_id)s, %(product_inventory_id)s, 1, %(price)s, %(price)s)
+        ON CONFLICT (user_id, product_inventory_id) DO UPDATE SET
+            quantity = {ORDER_ITEM_TABLE}.quantity + 1,
+            amount = {ORDER_ITEM_TABLE}.amount + {ORDER_ITEM_TABLE}.price,
+            cart_id = EXCLUDED.cart_id
+        RETURNING price
+    )
+    UPDATE {CART_TABLE} SET
+        quantity = {CART_TABLE}.quantity + 1,
+        total_amount = {CART_TABLE}.total_amount + item.price,
+        updated_at = %(now)s
+    FROM item
+    WHERE {CART_TABLE}.id = %(cart_id)s
+    RETURNING {CART_TABLE}.quantity, {CART_TABLE}.total_amount
+"""
+
+# deletes OrderItem and subtracts its quantity and amount from cart totals
+REMOVE_FROM_CART_SQL = f"""
+    WITH item AS (
+        DELETE FROM {ORDER_ITEM_TABLE}
+        WHERE user_id = %(user_id)s AND product_inventory_id IN (
+            SELECT id FROM {PRODUCT_INVENTORY_TABLE} WHERE sku = %(sku)s
+        )
+        RETURNING cart_id, quantity, amount
+    )
+    UPDATE {CART_TABLE} SET
+        quantity = {CART_TABLE}.quantity - item.quantity,
+        total_amount = {CART_TABLE}.total_amount - item.amount,
+        updated_at = %(now)s
+    FROM item
+    WHERE {CART_TABLE}.id = item.cart_id
+    RETURNING {CART_TABLE}.quantity, {CART_TABLE}.total_amount
+"""
+
+
+def get_price(product_inventory) -> Decimal:
+    return product_inventory.sale_price if product_inventory.is_on_sale else product_inventory.store_price
+
+
+def add_to_cart(user, product_inventory) -> CartTotals:
+    """Adds one unit of product_inventory to user's cart (creating the cart
+       if it does not exist) and returns new totals of the cart."""
+    with transaction.atomic():
+        cart, created = Cart.objects.get_or_create(user=user)
+        with connection.cursor() as cursor:
+            cursor.execute(ADD_TO_CART_SQL, {
+                'user_id': user.pk,
+                'cart_id': cart.pk,
+                'product_inventory_id': product_inventory.pk,
+                'price': get_price(product_inventory),
+                'now': timezone.now(),
+            })
+            return CartTotals(*cursor.fetchone())
+
+
+def remove_from_cart(user, sku: str) -> CartTotals:
+    """Removes OrderItem of ProductInventory with given sku from user's cart
+       and returns new totals of the cart. Raises OrderItem.DoesNotExist
+       if there is no such item in the cart."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(REMOVE_FROM_CART_SQL, {'user_id': user.pk, 'sku': sku, 'now': timezone.now()})
+        row = cursor.fetchone()
+    if row is None:
+        raise OrderItem.DoesNotExist(f'There is no item with sku {sku} in the cart.')
+    return CartTotals(*row)
+
+
+def clear_cart(user):
+    """Deletes all OrderItem objects from user's cart and resets its totals."""
+    with transaction.atomic():
+        OrderItem.objects.filter(cart__user=user).delete()
+        Cart.objects.filter(user=user).update(
+            quantity=0, total_amount=0, total_tax_amount=0, updated_at=timezone.now())
+
+
+def write_cart(user_id, lines: list[CartLine]) -> CartTotals:
+    """Replaces OrderItem objects of user's cart with 'lines' and updates cart
+       totals in one transaction. Tax amount is reset, taxes are computed
+       from cart lines (see ecommerce.taxes)."""
+    totals = CartTotals(sum(line.quantity for line in lines), sum((line.amount for line in lines), Decimal(0)))
+    with transaction.atomic():
+        cart, created = Cart.objects.select_for_update().get_or_create(user_id=user_id)
+        OrderItem.objects.filter(user_id=user_id).exclude(
+            product_inventory_id__in=[line.product_inventory_id for line in lines]).delete()
+        OrderItem.objects.bulk_create(
+            [OrderItem(user_id=user_id, cart=cart, product_inventory_id=line.product_inventory_id,
+                       quantity=line.quantity, price=line.price, amount=line.amount) for line in lines],
+            update_conflicts=True,
+            # attnames - Django 4.1 puts these names into ON CONFLICT clause as they are
+            unique_fields=['user_id', 'product_inventory_id'],
+            update_fields=['cart_id', 'quantity', 'price', 'amount'],
+        )
+        Cart.objects.filter(pk=cart.pk).update(quantity=totals.quantity, total_amount=totals.total_amount,
+                                               total_tax_amount=0, updated_at=timezone.now())
+    return totals
+
+
+def get_database_lines(user_id) -> list[CartLine]:
+    """Gets and returns lines of user's database cart."""
+    return [CartLine(*line) for line in OrderItem.objects.filter(user_id=user_id).order_by('id').values_list(
+        'product_inventory_id', 'product_inventory__sku', 'quantity', 'price', 'amount')]
+
+
+def get_session_lines(serialized_lines) -> list[CartLine]:
+    return [CartLine(product_inventory_id, sku, quantity, Decimal(price), Decimal(amount))
+            for product_inventory_id, sku, quantity, price, amount in serialized_lines]
+
+
+def serialize_lines(lines: list[CartLine]) -> list[list]:
+    """Lines with prices as strings - session data is JSON."""
+    return [[line.product_inventory_id, line.sku, line.quantity, str(line.price), str(line.amount)]
+            for line in lines]
+
+
+def merge_lines(database_lines, base_lines, lines) -> list[CartLine]:
+    """Three-way merge of carts - changes made in session (from 'base_lines',
+       which are already in the database, to 'lines') are applied to
+       the current database cart. Quantities are changed by differences,
+       so items added in other sessions stay in the cart and items of
+       a placed order do not come back."""
+    merged = {line.product_inventory_id: line for line in database_lines}
+    base = {line.product_inventory_id: line.quantity for line in base_lines}
+    changes = {line.product_inventory_id: (line, line.quantity - base.pop(line.product_inventory_id, 0))
+               for line in lines}
+    changes.update({product_inventory_id: (None, -quantity) for product_inventory_id, quantity in base.items()})
+
+    for product_inventory_id, (line, difference) in changes.items():
+        if difference == 0:
+            continue
+        line = merged.get(product_inventory_id, line)
+        quantity = (merged[product_inventory_id].quantity if product_inventory_id in merged else 0) + difference
+        if quantity > 0:
+            merged[product_inventory_id] = line._replace(quantity=quantity, amount=line.price * quantity)
+        else:
+            merged.pop(product_inventory_id, None)
+    return list(merged.values())
+
+
+def write_session_cart(session_key, cart, reload=False) -> list[CartLine] | None:
+    """Merges changes of cart kept in session into user's database cart
+       (see merge_lines) in one transaction, with the database cart locked.
+       SessionCart row of the session keeps the written revision of
+       the session cart, so its changes are never written twice. With
+       'reload', the session cart is replaced with the merged lines (the
+       caller saves them as the next revision). Returns merged lines,
+       or None if there were no changes to write."""
+    user_id = cart['user_id']
+    with transaction.atomic():
+        Cart.objects.select_for_update().get_or_create(user_id=user_id)
+        written = SessionCart.objects.select_for_update().filter(session_key=session_key, user_id=user_id).first()
+        if written is not None and written.revision > cart['base_revision']:
+            base_revision, base_lines = written.revision, get_session_lines(written.lines)
+        else:
+            base_revision, base_lines = cart['base_revision'], get_session_lines(cart['base'])
+        now = timezone.now()
+        if cart['revision'] <= base_revision:
+            SessionCart.objects.filter(session_key=session_key).update(flushed_at=now)
+            return None
+
+        lines = merge_lines(get_database_lines(user_id), base_lines, get_session_lines(cart['lines']))
+        write_cart(user_id, lines)
+        SessionCart.objects.bulk_create(
+            [SessionCart(session_key=session_key, user_id=user_id, marked_at=now, flushed_at=now,
+                         revision=cart['revision'] + 1 if reload else cart['revision'],
+                         lines=serialize_lines(lines) if reload else cart['lines'])],
+            update_conflicts=True,
+            unique_fields=['session_key'],
+            update_fields=['user_id', 'revision', 'lines', 'flushed_at'],
+        )
+    return lines
+
+
+def get_cart_store(request):
+    """Returns cart store (CART_STORE setting) of the request."""
+    if not hasattr(request, '_cart_store'):
+        request._cart_store = import_string(settings.CART_STORE)(request)
+    return request._cart_store
+
+
+class DatabaseCartStore:
+    """Cart kept in Cart and OrderItem tables, every change is written at once.
+       Cart totals are also kept in session (updated by every change), so
+       reading them costs no queries."""
+
+    def __init__(self, request):
+        self.request = request
+        self.user = request.user
+
+    def remember_totals(self, totals: CartTotals) -> CartTotals:
+        self.request.session[SESSION_CART_TOTALS_KEY] = [totals.quantity, str(totals.total_amount)]
+        return totals
+
+    def get_totals(self) -> CartTotals:
+        if not self.user.is_authenticated:
+            return CartTotals(0, Decimal(0))
+
+        totals = self.request.session.get(SESSION_CART_TOTALS_KEY)
+        if totals is not None:
+            return CartTotals(totals[0], Decimal(totals[1]))
+        totals = Cart.objects.filter(user=self.user).values_list('quantity', 'total_amount').first()
+        return self.remember_totals(CartTotals(*totals) if totals else CartTotals(0, Decimal(0)))
+
+    def get_lines(self) -> list[CartLine]:
+        return get_database_lines(self.user.pk)
+
+    def add(self, product_inventory) -> CartTotals:
+        return self.remember_totals(add_to_cart(self.user, product_inventory))
+
+    def remove(self, sku: str) -> CartTotals:
+        return self.remember_totals(remove_from_cart(self.user, sku))
+
+    def clear(self):
+        clear_cart(self.user)
+        self.remember_totals(CartTotals(0, Decimal(0)))
+
+    def forget(self):
+        """Cart was already cleared in the database (order was placed)."""
+        self.remember_totals(CartTotals(0, Decimal(0)))
+
+    def flush(self):
+        """Changes are already in the database."""
+
+
+class SessionCartStore:
+    """Cart kept in session - cart lines (with prices and amounts), id
+       of the user it belongs to, lines of the database cart it is based on
+       and revision (incremented by every change). Reading and changing
+       it costs no queries (except marking the cart as changed, at most
+       once per MARK_INTERVAL), changes are merged into Cart and OrderItem
+       tables by flush() (before placing an order) or by flush_carts
+       command. Database cart of a user is loaded (and merged with lines
+       added before logging in) once per session."""
+
+    def __init__(self, request):
+        self.request = request
+        self.user = request.user
+
+    @cached_property
+    def cart(self) -> dict:
+        cart = self.request.session.get(SESSION_CART_KEY) or {
+            'user_id': None, 'lines': [], 'base': [], 'revision': 0, 'base_revision': 0}
+        if self.user.is_authenticated and cart['user_id'] != self.user.pk:
+            lines = get_database_lines(self.user.pk)
+            changed = bool(cart['lines'])
+            cart.update(user_id=self.user.pk, base=serialize_lines(lines), base_revision=cart['revision'])
+            for line in get_session_lines(cart['lines']):
+                lines = self.add_line(lines, line)
+            self.save(cart, lines, changed=changed)
+        return cart
+
+    @staticmethod
+    def add_line(lines, new_line) -> list[CartLine]:
+        for i, line in enumerate(lines):
+            if line.product_inventory_id == new_line.product_inventory_id:
+                lines[i] = line._replace(quantity=line.quantity + new_line.quantity,
+                                         amount=line.amount + new_line.amount)
+                return lines
+        return lines + [new_line]
+
+    def mark(self, cart):
+        """Marks the cart as changed (see flush_carts command)."""
+        session_key = self.request.session.session_key
+        if not self.user.is_authenticated or session_key is None or \
+                time.time() - cart.get('marked_at', 0) < MARK_INTERVAL:
+            return
+        SessionCart.objects.bulk_create(
+            [SessionCart(session_key=session_key, user=self.user, marked_at=timezone.now())],
+            update_conflicts=True,
+            unique_fields=['session_key'],
+            update_fields=['user_id', 'marked_at'],
+        )
+        cart['marked_at'] = time.time()
+
+    def save(self, cart, lines, changed=True):
+        """Stores lines in session, as a new revision if they were changed."""
+        cart['lines'] = serialize_lines(lines)
+        if changed:
+            cart['revision'] += 1
+            self.mark(cart)
+        self.request.session[SESSION_CART_KEY] = cart
+
+    def get_lines(self) -> list[CartLine]:
+        return get_session_lines(self.cart['lines'])
+
+    def get_totals(self) -> CartTotals:
+        lines = self.get_lines()
+        return CartTotals(sum(line.quantity for line in lines), sum((line.amount for line in lines), Decimal(0)))
+
+    def add(self, product_inventory) -> CartTotals:
+        price = get_price(product_inventory)
+        self.save(self.cart, self.add_line(self.get_lines(), CartLine(
+            product_inventory.id, product_inventory.sku, 1, price, price)))
+        return self.get_totals()
+
+    def remove(self, sku: str) -> CartTotals:
+        lines = self.get_lines()
+        if sku not in {line.sku for line in lines}:
+            raise OrderItem.DoesNotExist(f'There is no item with sku {sku} in the cart.')
+        self.save(self.cart, [line for line in lines if line.sku != sku])
+        return self.get_totals()
+
+    def clear(self):
+        self.save(self.cart, [])
+
+    def set_base(self, lines):
+        """Replaces the cart with lines that are in the database cart."""
+        cart = self.cart
+        cart.update(revision=cart['revision'] + 1, base=serialize_lines(lines))
+        cart['base_revision'] = cart['revision']
+        self.save(cart, lines, changed=False)
+
+    def forget(self):
+        """Cart was already cleared in the database (order was placed)."""
+        self.set_base([])
+
+    def flush(self):
+        """Merges changes of the cart into the database cart and
+           replaces the cart with the merged one."""
+        session_key = self.request.session.session_key
+        if self.user.is_authenticated and session_key is not None and \
+                self.cart['revision'] > self.cart['base_revision']:
+            lines = write_session_cart(session_key, self.cart, reload=True)
+            if lines is not None:
+                self.set_base(lines)
@@ -1,11 +1,10 @@
-from ecommerce.models import Cart
+from django.utils.functional import SimpleLazyObject
 
+from ecommerce.cart import get_cart_store
 
-def get_cart_quantity(request):
-    """Gets and returns as dictionary cart quantity of a logged-in user"""
-    try:
-        quantity = Cart.objects.get(user=request.user).quantity
-    except Exception:
-        quantity = 0
-    return dict(cart_quantity=quantity)
 
+def get_cart_quantity(request):
+    """Returns as dictionary cart quantity of a user. It is lazy - computed
+       only if a template uses it, from cart store (that keeps it
+       in session, so it costs no queries)."""
+    return dict(cart_quantity=SimpleLazyObject(lambda: get_cart_store(request).get_totals().quantity))
@@ -0,0 +1,51 @@
+"""
+Django command to write carts kept in sessions to the database
+"""
+import time
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ecommerce.cart import SESSION_CART_KEY, MARK_INTERVAL, write_session_cart
+from ecommerce.models import SessionCart
+
+
+class Command(BaseCommand):
+    """Django command (write-behind for SessionCartStore) that merges changed
+       carts of logged-in users from sessions into Cart and OrderItem tables.
+       Only sessions marked as changed (SessionCart) are loaded. Changes are
+       marked at most once per MARK_INTERVAL, so a cart is checked until
+       it was flushed 2 * MARK_INTERVAL after it was marked (the session
+       is saved after the response)."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Repeat every N seconds instead of running once.')
+
+    def flush(self) -> int:
+        flushed = 0
+        session_store = import_module(settings.SESSION_ENGINE).SessionStore
+        session_carts = SessionCart.objects.filter(
+            Q(flushed_at__isnull=True) | Q(flushed_at__lt=F('marked_at') + timedelta(seconds=2 * MARK_INTERVAL)))
+        for session_cart in session_carts.iterator():
+            cart = session_store(session_cart.session_key).load().get(SESSION_CART_KEY)
+            if cart is None or cart.get('user_id') != session_cart.user_id:
+                # the session expired (or the user logged out)
+                SessionCart.objects.filter(pk=session_cart.pk, marked_at=session_cart.marked_at).delete()
+                continue
+            if write_session_cart(session_cart.session_key, cart) is not None:
+                flushed += 1
+        return flushed
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        while True:
+            flushed = self.flush()
+            self.stdout.write(self.style.SUCCESS(f'{flushed} carts written to the database.'))
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from ecommerce.models import Product
+from ecommerce.utils import update_attribute_values_index
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    """Recompute attribute values index (ProductAttributeValuesIndex) of all products."""
+
+    def handle(self, *args, **kwargs):
+        product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(product_ids), BATCH_SIZE):
+            update_attribute_values_index(product_ids[start:start + BATCH_SIZE])
+        self.stdout.write(self.style.SUCCESS(f'Attribute values index refreshed for {len(product_ids)} products.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from ecommerce.models import Category
+from ecommerce.utils import update_facet_counts
+
+
+class Command(BaseCommand):
+    """Recompute facet counts (CategoryFacetCount) of all categories."""
+
+    def handle(self, *args, **kwargs):
+        category_ids = list(Category.objects.values_list('id', flat=True))
+        update_facet_counts(category_ids + [None])
+        self.stdout.write(self.style.SUCCESS(f'Facet counts refreshed for {len(category_ids)} categories.'))
@@ -0,0 +1,108 @@
+"""
+Django command to precompute 'You might also like' recommendations
+"""
+import json
+import random
+from collections import Counter, defaultdict
+from itertools import combinations
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ecommerce.models import Product, ProductInventory, ProductAttributeValues, PlacedOrder, ProductRecommendation
+from ecommerce.utils import bump_cache_version, RECOMMENDATIONS_VERSION_KEY
+
+# how much every shared feature adds to relatedness score
+CATEGORY_WEIGHT = 3.0
+ATTRIBUTE_VALUE_WEIGHT = 1.0
+CO_OCCURRENCE_WEIGHT = 2.0
+
+# products sharing a feature with more products are not paired with all of them
+# (number of pairs grows quadratically), but with a random sample of them
+MAX_POSTING_SIZE = 200
+POSTING_SAMPLE_SIZE = 50
+
+
+class Command(BaseCommand):
+    """Django command to score relatedness of products (shared categories,
+       shared attribute values and co-occurrence in placed orders) and
+       store top N related products of every product."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10,
+                            help='Number of recommendations stored for every product.')
+
+    @staticmethod
+    def get_postings(pairs) -> list[set]:
+        """Groups (feature, product id) pairs into sets of products sharing a feature."""
+        postings = defaultdict(set)
+        for feature, product_id in pairs:
+            postings[feature].add(product_id)
+        return list(postings.values())
+
+    @staticmethod
+    def get_pairs(products, rng):
+        """Yields pairs of products sharing a feature - all pairs of a small
+           posting, or every product with POSTING_SAMPLE_SIZE random
+           products of a posting larger than MAX_POSTING_SIZE."""
+        if len(products) <= MAX_POSTING_SIZE:
+            yield from combinations(products, 2)
+            return
+        products = list(products)
+        for first in products:
+            sample = [second for second in rng.sample(products, POSTING_SAMPLE_SIZE + 1) if second != first]
+            for second in sample[:POSTING_SAMPLE_SIZE]:
+                yield first, second
+
+    @staticmethod
+    def get_orders_postings(sku_to_product) -> list[set]:
+        """Returns sets of products bought together in one PlacedOrder."""
+        postings = []
+        for order_items in PlacedOrder.objects.values_list('order_items', flat=True).iterator():
+            if isinstance(order_items, str):  # order items are stored as a JSON string
+                order_items = json.loads(order_items)
+            products = {sku_to_product.get(item.get('sku')) for item in order_items or []}
+            products.discard(None)
+            postings.append(products)
+        return postings
+
+    def get_scores(self, active_ids) -> dict[int: Counter]:
+        product_categories = Product.category.through.objects.filter(
+            product_id__in=active_ids).values_list('category_id', 'product_id')
+        product_values = ProductAttributeValues.objects.filter(
+            productinventory__product_id__in=active_ids).values_list(
+            'attributevalues_id', 'productinventory__product_id').distinct()
+        sku_to_product = dict(ProductInventory.objects.filter(
+            product_id__in=active_ids).values_list('sku', 'product_id'))
+
+        scores = defaultdict(Counter)
+        rng = random.Random(0)
+        for weight, postings in (
+                (CATEGORY_WEIGHT, self.get_postings(product_categories)),
+                (ATTRIBUTE_VALUE_WEIGHT, self.get_postings(product_values)),
+                (CO_OCCURRENCE_WEIGHT, self.get_orders_postings(sku_to_product)),
+        ):
+            for products in postings:
+                for first, second in self.get_pairs(products, rng):
+                    scores[first][second] += weight
+                    scores[second][first] += weight
+        return scores
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        active_ids = set(Product.objects.filter(is_active=True).values_list('id', flat=True))
+        scores = self.get_scores(active_ids)
+
+        recommendations = [
+            ProductRecommendation(product_id=product_id, recommended_product_id=recommended_id, score=score)
+            for product_id, product_scores in scores.items()
+            for recommended_id, score in product_scores.most_common(options['top'])
+        ]
+        with transaction.atomic():
+            ProductRecommendation.objects.all().delete()
+            ProductRecommendation.objects.bulk_create(recommendations, batch_size=1000)
+        # product page snapshots keep recommendation cards
+        bump_cache_version(RECOMMENDATIONS_VERSION_KEY)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(recommendations)} recommendations stored for {len(scores)} products.'))
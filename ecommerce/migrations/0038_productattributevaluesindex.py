@@ -0,0 +1,26 @@
+# Generated by Django 4.1.1 on 2026-10-18 14:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0037_alter_order_order_number_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductAttributeValuesIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attribute_values', models.JSONField(default=dict)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='attribute_values_index', to='ecommerce.product')),
+            ],
+            options={
+                'verbose_name': 'product attribute values index',
+                'verbose_name_plural': 'product attribute values indexes',
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.1 on 2026-10-18 14:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0038_productattributevaluesindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_count', models.PositiveIntegerField(default=0)),
+                ('attribute_value', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='ecommerce.productattributevalue')),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='ecommerce.category')),
+            ],
+            options={
+                'unique_together': {('category', 'attribute_value')},
+            },
+        ),
+    ]
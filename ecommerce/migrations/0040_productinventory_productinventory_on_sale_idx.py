@@ -0,0 +1,17 @@
+# Generated by Django 4.1.1 on 2026-10-18 14:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0039_categoryfacetcount'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productinventory',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_on_sale', True)), fields=['-updated_at', 'id'], name='productinventory_on_sale_idx'),
+        ),
+    ]
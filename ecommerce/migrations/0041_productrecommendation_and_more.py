@@ -0,0 +1,31 @@
+# Generated by Django 4.1.1 on 2026-10-18 14:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0040_productinventory_productinventory_on_sale_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='ecommerce.product')),
+                ('recommended_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_for', to='ecommerce.product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productrecommendation',
+            index=models.Index(fields=['product', '-score'], name='recommendation_product_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='productrecommendation',
+            unique_together={('product', 'recommended_product')},
+        ),
+    ]
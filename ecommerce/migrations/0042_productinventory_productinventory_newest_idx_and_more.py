@@ -0,0 +1,21 @@
+# Generated by Django 4.1.1 on 2026-10-18 15:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0041_productrecommendation_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productinventory',
+            index=models.Index(fields=['updated_at', 'id'], name='productinventory_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinventory',
+            index=models.Index(fields=['store_price', 'id'], name='productinventory_price_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.1 on 2026-10-18 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0042_productinventory_productinventory_newest_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='facet_counts_computed',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
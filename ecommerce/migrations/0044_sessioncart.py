@@ -0,0 +1,28 @@
+# Generated by Django 4.1.1 on 2026-10-18 16:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ecommerce', '0043_category_facet_counts_computed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionCart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=40, unique=True)),
+                ('revision', models.IntegerField(default=0)),
+                ('lines', models.JSONField(default=list)),
+                ('marked_at', models.DateTimeField()),
+                ('flushed_at', models.DateTimeField(null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
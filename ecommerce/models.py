@@ -24,6 +24,9 @@ class Category(MPTTModel):
 
     is_active = models.BooleanField(default=True)
 
+    # whether CategoryFacetCount rows of the category were computed
+    facet_counts_computed = models.BooleanField(default=False, editable=False)
+
     parent = TreeForeignKey('self', on_delete=models.PROTECT,
                             related_name='children',
                             null=True,
@@ -189,6 +192,15 @@ class ProductInventory(models.Model):
     class Meta:
         verbose_name = _('product inventory')
         verbose_name_plural = _('product inventories')
+        indexes = [
+            # partial index for listing products that are on sale
+            models.Index(fields=['-updated_at', 'id'],
+                         name='productinventory_on_sale_idx',
+                         condition=models.Q(is_on_sale=True, is_active=True)),
+            # indexes for keyset pagination of products listings
+            models.Index(fields=['updated_at', 'id'], name='productinventory_newest_idx'),
+            models.Index(fields=['store_price', 'id'], name='productinventory_price_idx'),
+        ]
 
 
 class Media(models.Model):
@@ -262,6 +274,68 @@ class ProductAttributeValues(models.Model):
         unique_together = (('attributevalues', 'productinventory'),)
 
 
+class ProductAttributeValuesIndex(models.Model):
+    """Denormalized attribute values of all products inventories
+       of a product - {attribute name: sorted values}. It is kept
+       up to date by signals (ecommerce.signals)."""
+    product = models.OneToOneField(Product,
+                                   related_name='attribute_values_index',
+                                   on_delete=models.CASCADE)
+
+    attribute_values = models.JSONField(default=dict)
+
+    def __str__(self):
+        return f'{self.product} | Attribute values'
+
+    class Meta:
+        verbose_name = _('product attribute values index')
+        verbose_name_plural = _('product attribute values indexes')
+
+
+class CategoryFacetCount(models.Model):
+    """Materialized number of products inventories with a given attribute
+       value in a given category (category=None means all products).
+       It is kept up to date by signals (ecommerce.signals)."""
+    category = models.ForeignKey(Category, null=True,
+                                 related_name='facet_counts',
+                                 on_delete=models.CASCADE)
+
+    attribute_value = models.ForeignKey(ProductAttributeValue,
+                                        related_name='facet_counts',
+                                        on_delete=models.CASCADE)
+
+    product_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.category} | {self.attribute_value} ({self.product_count})'
+
+    class Meta:
+        unique_together = (('category', 'attribute_value'),)
+
+
+class ProductRecommendation(models.Model):
+    """Products recommended for a product ('You might also like'),
+       computed offline by refresh_recommendations command."""
+    product = models.ForeignKey(Product,
+                                related_name='recommendations',
+                                on_delete=models.CASCADE)
+
+    recommended_product = models.ForeignKey(Product,
+                                            related_name='recommended_for',
+                                            on_delete=models.CASCADE)
+
+    score = models.FloatField()
+
+    def __str__(self):
+        return f'{self.product} -> {self.recommended_product} ({self.score})'
+
+    class Meta:
+        unique_together = (('product', 'recommended_product'),)
+        indexes = [
+            models.Index(fields=['product', '-score'], name='recommendation_product_idx'),
+        ]
+
+
 class ProductTypeAttribute(models.Model):
     """Product type attributes link table."""
     product_attribute = models.ForeignKey(ProductAttribute,
@@ -296,6 +370,21 @@ class Cart(models.Model):
         return f"{self.user}'s cart"
 
 
+class SessionCart(models.Model):
+    """Cart kept in session (see ecommerce.cart.SessionCartStore) - index
+       of carts changed since they were written to the database (marked_at,
+       flushed_at), and session cart lines written last with their revision."""
+    session_key = models.CharField(max_length=40, unique=True)
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
+    revision = models.IntegerField(default=0)
+    lines = models.JSONField(default=list)
+    marked_at = models.DateTimeField()
+    flushed_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f'{self.user} | {self.session_key}'
+
+
 class OrderItem(models.Model):
     """Table for order items. It's a 'middleman' between
        ProductInventory and Cart. Thanks to this we can
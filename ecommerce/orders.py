@@ -0,0 +1,87 @@
+"""Order placement - turns user's cart into PlacedOrder in one transaction.
+
+Cart row and Stock rows of ordered products are locked (always in the
+same order - cart first, then stocks by product inventory id - so
+concurrent orders do not deadlock), stock is checked and decremented
+with one UPDATE statement, PlacedOrder is created and the cart is
+cleared, all in one commit. A product that is sold out in the meantime
+rolls the whole order back. The raw UPDATE sends no signals, so ordered
+products are queued for reindexing and their pages are invalidated
+(only theirs - not the whole catalog) in the same transaction.
+"""
+import json
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from search.signals import OutboxSignalProcessor
+
+from .models import Cart, OrderItem, PlacedOrder, ProductInventory, Stock
+from .taxes import compute_taxes
+from .utils import touch_products
+
+STOCK_TABLE = Stock._meta.db_table
+
+
+class OutOfStockError(Exception):
+    """Raised when there are not enough units of ordered products in stock."""
+
+    def __init__(self, skus):
+        self.skus = skus
+        super().__init__(f'Not enough units in stock: {", ".join(skus)}.')
+
+
+def get_update_stock_sql(number_of_items: int) -> str:
+    """SQL decrementing units (and incrementing units sold) of stocks
+       by quantities given as (product_inventory_id, quantity) pairs."""
+    values = ', '.join(['(%s, %s)'] * number_of_items)
+    return f"""
+        UPDATE {STOCK_TABLE} SET
+            units = {STOCK_TABLE}.units - sold.quantity,
+            units_sold = {STOCK_TABLE}.units_sold + sold.quantity
+        FROM (VALUES {values}) AS sold (product_inventory_id, quantity)
+        WHERE {STOCK_TABLE}.product_inventory_id = sold.product_inventory_id
+    """
+
+
+def place_order(user, order) -> PlacedOrder | None:
+    """Places order of items in user's cart - updates stock, creates
+       PlacedOrder and clears the cart. Returns None if the cart is empty
+       (e.g. the order was already placed). Raises OutOfStockError
+       (and changes nothing) if any product is sold out."""
+    with transaction.atomic():
+        cart = Cart.objects.select_for_update().filter(user=user).first()
+        order_items = list(OrderItem.objects.filter(user=user).select_related(
+            'product_inventory__product').order_by('product_inventory_id'))
+        if cart is None or not order_items:
+            return None
+
+        units = dict(Stock.objects.select_for_update().filter(
+            product_inventory_id__in=[item.product_inventory_id for item in order_items]
+        ).order_by('product_inventory_id').values_list('product_inventory_id', 'units'))
+        sold_out = [item.product_inventory.sku for item in order_items
+                    if units.get(item.product_inventory_id, 0) < item.quantity]
+        if sold_out:
+            raise OutOfStockError(sold_out)
+
+        with connection.cursor() as cursor:
+            cursor.execute(get_update_stock_sql(len(order_items)),
+                           [value for item in order_items for value in (item.product_inventory_id, item.quantity)])
+        OutboxSignalProcessor.enqueue(ProductInventory, [item.product_inventory_id for item in order_items])
+        touch_products({item.product_inventory.product_id for item in order_items})
+
+        placed_order = PlacedOrder.objects.create(
+            user=user,
+            order_items=json.dumps([
+                {'product': str(item.product_inventory), 'sku': item.product_inventory.sku, 'quantity': item.quantity}
+                for item in order_items
+            ], indent=4),
+            total_amount=sum(item.amount for item in order_items) + compute_taxes(order_items).total,
+            order_number=order.order_number,
+            order_date=order.created_at,
+        )
+
+        OrderItem.objects.filter(pk__in=[item.pk for item in order_items]).delete()
+        Cart.objects.filter(pk=cart.pk).update(
+            quantity=0, total_amount=0, total_tax_amount=0, updated_at=timezone.now())
+    return placed_order
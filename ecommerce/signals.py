@@ -0,0 +1,209 @@
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_save, post_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+
+from .models import Category, Product, ProductInventory, ProductAttributeValue, ProductAttributeValues, \
+    ProductAttribute, Stock, Media, Tax, Brand, ProductType
+from .cart import get_cart_store
+from .utils import update_attribute_values_index, update_facet_counts, update_facet_counts_of_links, \
+    touch_products, bump_cache_version, ATTRIBUTE_POSTINGS_VERSION_KEY, CATALOG_VERSION_KEY, \
+    CATEGORY_TREE_VERSION_KEY, TAX_TABLE_VERSION_KEY
+
+
+def update_products_listing_data(product_ids):
+    """Update data precomputed for products listings (attribute
+       values index) of products with given ids."""
+    update_attribute_values_index(set(product_ids))
+    touch_products(set(product_ids))
+    bump_cache_version(CATALOG_VERSION_KEY)
+
+
+def attribute_links_changed(added=(), removed=()):
+    """Update listing data after links between product inventories and
+       attribute values were added or removed - (product inventory id,
+       attribute value id) pairs. Facet counts are changed by deltas."""
+    added, removed = list(added), list(removed)
+    product_ids = dict(ProductInventory.objects.filter(
+        pk__in={product_inventory_id for product_inventory_id, _ in added + removed}).values_list('id', 'product_id'))
+    for links, delta in ((added, 1), (removed, -1)):
+        update_facet_counts_of_links(
+            [(product_ids[pi_id], value_id) for pi_id, value_id in links if pi_id in product_ids], delta)
+    update_products_listing_data(product_ids.values())
+    # posting lists are keyed by ids of product inventories, so only links change them
+    bump_cache_version(ATTRIBUTE_POSTINGS_VERSION_KEY)
+
+
+def count_links(link) -> int:
+    """Number of ProductAttributeValues rows linking the same ProductInventory
+       and ProductAttributeValue (the table does not prevent duplicates)."""
+    product_inventory_id, attribute_value_id = link
+    return ProductAttributeValues.objects.filter(
+        productinventory_id=product_inventory_id, attributevalues_id=attribute_value_id).count()
+
+
+# ================ ATTRIBUTE VALUES INDEX AND FACET COUNTS ================
+
+@receiver(pre_save, sender=ProductInventory)
+def pre_save_product_inventory_receiver(sender, instance, **kwargs):
+    """Remember the previous product, so its data can be
+       updated if ProductInventory was moved to another product."""
+    if instance.pk:
+        instance._previous_product_id = ProductInventory.objects.filter(
+            pk=instance.pk).values_list('product_id', flat=True).first()
+
+
+@receiver(post_save, sender=ProductInventory)
+def product_inventory_listing_data_receiver(sender, instance, **kwargs):
+    """Listing data depends only on attribute values of products, so it changes
+       only when ProductInventory is moved to another product (new inventories
+       have no attribute values yet, inventories with them cannot be deleted)."""
+    previous_product_id = getattr(instance, '_previous_product_id', None)
+    if previous_product_id is None or previous_product_id == instance.product_id:
+        return
+
+    value_ids = list(ProductAttributeValues.objects.filter(
+        productinventory=instance).values_list('attributevalues_id', flat=True).distinct())
+    # counts of all products do not change
+    update_facet_counts_of_links([(previous_product_id, value_id) for value_id in value_ids], -1, all_products=False)
+    update_facet_counts_of_links([(instance.product_id, value_id) for value_id in value_ids], 1, all_products=False)
+    update_products_listing_data([previous_product_id, instance.product_id])
+
+
+@receiver(pre_save, sender=ProductAttributeValues)
+def pre_save_product_attribute_values_receiver(sender, instance, **kwargs):
+    """Remember the previous link, so it can be removed if it was changed."""
+    if instance.pk:
+        instance._previous_link = ProductAttributeValues.objects.filter(pk=instance.pk).values_list(
+            'productinventory_id', 'attributevalues_id').first()
+
+
+@receiver(post_save, sender=ProductAttributeValues)
+def product_attribute_values_saved_receiver(sender, instance, created, **kwargs):
+    link = (instance.productinventory_id, instance.attributevalues_id)
+    previous_link = getattr(instance, '_previous_link', None)
+    if not created and previous_link == link:
+        return
+    attribute_links_changed(added=[link] if count_links(link) == 1 else [],
+                            removed=[previous_link] if previous_link and not count_links(previous_link) else [])
+
+
+@receiver(post_delete, sender=ProductAttributeValues)
+def product_attribute_values_deleted_receiver(sender, instance, **kwargs):
+    """Removing attribute values with ProductInventory.attribute_values.remove()
+       or clear() deletes ProductAttributeValues rows, so it is handled here too."""
+    link = (instance.productinventory_id, instance.attributevalues_id)
+    if not count_links(link):
+        attribute_links_changed(removed=[link])
+
+
+@receiver(m2m_changed, sender=ProductInventory.attribute_values.through)
+def attribute_values_added_receiver(sender, instance, action, reverse, pk_set, **kwargs):
+    """Update listing data when attribute values are added to ProductInventory (or
+       ProductInventory objects are added to ProductAttributeValue on the reverse
+       side) - add() creates links with bulk_create, which sends no post_save."""
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        attribute_links_changed(added=[(product_inventory_id, instance.pk) for product_inventory_id in pk_set])
+    else:
+        attribute_links_changed(added=[(instance.pk, value_id) for value_id in pk_set])
+
+
+@receiver(m2m_changed, sender=Product.category.through)
+def product_category_changed_receiver(sender, instance, action, reverse, pk_set, **kwargs):
+    """Update facet counts of categories that products were
+       added to or removed from."""
+    if reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            update_facet_counts([instance.pk])
+        return
+
+    if action == 'pre_clear':
+        instance._cleared_category_ids = set(instance.category.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        update_facet_counts(pk_set)
+    elif action == 'post_clear':
+        update_facet_counts(getattr(instance, '_cleared_category_ids', set()))
+
+
+@receiver(post_save, sender=ProductAttributeValue)
+def product_attribute_value_index_receiver(sender, instance, created, **kwargs):
+    if not created:
+        product_ids = set(ProductInventory.objects.filter(
+            attribute_values=instance).values_list('product_id', flat=True))
+        update_attribute_values_index(product_ids)
+        touch_products(product_ids)
+        bump_cache_version(ATTRIBUTE_POSTINGS_VERSION_KEY)
+
+
+@receiver(post_save, sender=ProductAttribute)
+def product_attribute_index_receiver(sender, instance, created, **kwargs):
+    if not created:
+        product_ids = set(ProductInventory.objects.filter(
+            attribute_values__product_attribute=instance).values_list('product_id', flat=True))
+        update_attribute_values_index(product_ids)
+        touch_products(product_ids)
+        bump_cache_version(ATTRIBUTE_POSTINGS_VERSION_KEY)
+
+
+# ================ PRODUCT PAGE ================
+
+@receiver(post_save, sender=ProductInventory)
+@receiver(post_delete, sender=ProductInventory)
+@receiver(post_save, sender=Media)
+@receiver(post_delete, sender=Media)
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+def product_page_receiver(sender, instance, **kwargs):
+    """Invalidate cached page of the product (see ProductDetailView.snapshot)."""
+    product_inventory_id = instance.pk if sender is ProductInventory else instance.product_inventory_id
+    touch_products(ProductInventory.objects.filter(pk=product_inventory_id).values('product_id'))
+
+
+# ================ CATEGORY TREE ================
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_tree_receiver(sender, **kwargs):
+    bump_cache_version(CATEGORY_TREE_VERSION_KEY)
+
+
+# ================ CATALOG VERSION ================
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductInventory)
+@receiver(post_delete, sender=ProductInventory)
+@receiver(post_save, sender=Media)
+@receiver(post_delete, sender=Media)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=ProductType)
+@receiver(post_delete, sender=ProductType)
+@receiver(post_save, sender=ProductAttributeValue)
+@receiver(post_save, sender=ProductAttribute)
+def catalog_version_receiver(sender, **kwargs):
+    """Invalidate data cached for the catalog (e.g. main shop page showcase).
+       Stock changes with every order, so it only invalidates pages of its
+       product (see product_page_receiver)."""
+    bump_cache_version(CATALOG_VERSION_KEY)
+
+
+# ================ CART ================
+
+@receiver(user_logged_out)
+def flush_cart_receiver(sender, request, user, **kwargs):
+    """Session (with cart kept in it) is flushed after logging out."""
+    if request is not None and user is not None:
+        get_cart_store(request).flush()
+
+
+# ================ TAX TABLE ================
+
+@receiver(post_save, sender=Tax)
+@receiver(post_delete, sender=Tax)
+@receiver(m2m_changed, sender=Tax.product_type.through)
+def tax_table_receiver(sender, **kwargs):
+    bump_cache_version(TAX_TABLE_VERSION_KEY)
@@ -0,0 +1,62 @@
+"""Tax engine - computes taxes of cart lines.
+
+Active taxes of every product type are loaded once into a lookup table
+kept in cache (until a tax changes), so taxes of a whole cart are
+computed in one pass without querying taxes per item. Tax amounts are
+rounded per line (to cents, half up) and the total is the sum of rounded
+lines, so the displayed lines always add up to the total.
+"""
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.cache import cache
+
+from .models import OrderItem, Tax
+from .utils import get_cache_version, TAX_TABLE_VERSION_KEY
+
+TAX_QUANTUM = Decimal('0.01')
+TAX_TABLE_TIMEOUT = 60 * 60 * 24
+
+TaxLine = namedtuple('TaxLine', ['item', 'tax', 'amount'])
+CartTaxes = namedtuple('CartTaxes', ['lines', 'total'])
+
+
+def build_tax_table() -> dict[int: list[Tax]]:
+    """Builds and returns {product type id: [active Tax objects]} using two queries."""
+    taxes = {tax.id: tax for tax in Tax.objects.filter(is_active=True).order_by('id')}
+    table = {}
+    for product_type_id, tax_id in Tax.product_type.through.objects.filter(
+            tax_id__in=taxes).order_by('tax_id').values_list('producttype_id', 'tax_id'):
+        table.setdefault(product_type_id, []).append(taxes[tax_id])
+    return table
+
+
+def get_tax_table() -> dict[int: list[Tax]]:
+    """Gets and returns cached tax table (see build_tax_table)."""
+    key = f'tax_table:{get_cache_version(TAX_TABLE_VERSION_KEY)}'
+    table = cache.get(key)
+    if table is None:
+        table = build_tax_table()
+        cache.set(key, table, TAX_TABLE_TIMEOUT)
+    return table
+
+
+def get_tax_amount(amount: Decimal, tax: Tax) -> Decimal:
+    return (amount * tax.tax_percentage / 100).quantize(TAX_QUANTUM, rounding=ROUND_HALF_UP)
+
+
+def compute_taxes(items) -> CartTaxes:
+    """Computes taxes of items (OrderItem objects, with product_inventory
+       loaded) - a TaxLine for every item and tax of its product type,
+       and the total tax amount."""
+    table = get_tax_table()
+    lines = [TaxLine(item, tax, get_tax_amount(item.amount, tax))
+             for item in items
+             for tax in table.get(item.product_inventory.product_type_id, [])]
+    return CartTaxes(lines, sum((line.amount for line in lines), Decimal('0.00')))
+
+
+def get_cart_taxes(user) -> CartTaxes:
+    """Computes taxes of user's cart."""
+    return compute_taxes(OrderItem.objects.filter(cart__user=user).select_related(
+        'product_inventory__product').order_by('id'))
@@ -0,0 +1,142 @@
+"""Tests for cart service of ecommerce app."""
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import pytest
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.db import connection
+
+from ecommerce import models
+from ecommerce.cart import add_to_cart, remove_from_cart, clear_cart, get_cart_store, get_database_lines, \
+    SessionCartStore
+from ecommerce.context_processors import get_cart_quantity
+from ecommerce.taxes import get_cart_taxes
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_add_to_cart_does_not_lose_updates(create_test_user, product_inventory_factory):
+    """Test that parallel adds of the same product give exact totals."""
+    product_inventory = product_inventory_factory.create(store_price=Decimal('10.50'), is_on_sale=False)
+    number_of_adds = 20
+
+    def add(_):
+        try:
+            return add_to_cart(create_test_user, product_inventory)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(add, range(number_of_adds)))
+
+    cart = models.Cart.objects.get(user=create_test_user)
+    order_item = models.OrderItem.objects.get(cart=cart, product_inventory=product_inventory)
+    assert cart.quantity == order_item.quantity == number_of_adds
+    assert cart.total_amount == order_item.amount == Decimal('10.50') * number_of_adds
+
+    totals = remove_from_cart(create_test_user, product_inventory.sku)
+    assert totals == (0, Decimal('0.00'))
+    with pytest.raises(models.OrderItem.DoesNotExist):
+        remove_from_cart(create_test_user, product_inventory.sku)
+
+
+def get_session_cart_store(rf, user) -> SessionCartStore:
+    request = rf.get('/')
+    SessionMiddleware(lambda r: None).process_request(request)
+    request.session.save()
+    request.user = user
+    return SessionCartStore(request)
+
+
+def test_session_cart_store_writes_cart_on_flush(
+        db, rf, django_assert_num_queries, create_test_user, product_inventory_factory):
+    """Test that cart kept in session is changed without queries (except
+       marking it as changed) and written to the database (merged with
+       the saved cart) on flush."""
+    saved = product_inventory_factory.create(store_price=Decimal('5.00'), is_on_sale=False)
+    added = product_inventory_factory.create(store_price=Decimal('10.00'), is_on_sale=False)
+    add_to_cart(create_test_user, saved)
+
+    cart_store = get_session_cart_store(rf, create_test_user)
+    assert cart_store.get_totals() == (1, Decimal('5.00'))
+
+    # marking the cart as changed
+    with django_assert_num_queries(1):
+        cart_store.add(added)
+        cart_store.add(added)
+        assert cart_store.get_totals() == (3, Decimal('25.00'))
+    assert models.Cart.objects.get(user=create_test_user).quantity == 1
+
+    cart_store.flush()
+    cart = models.Cart.objects.get(user=create_test_user)
+    assert (cart.quantity, cart.total_amount) == (3, Decimal('25.00'))
+    assert models.OrderItem.objects.get(user=create_test_user, product_inventory=added).quantity == 2
+
+
+
+def test_session_carts_are_merged_into_database_cart(db, rf, create_test_user, product_inventory_factory):
+    """Test that changes made in different sessions of the user are all
+       kept and items of an order placed in another session do not come back."""
+    first = product_inventory_factory.create(store_price=Decimal('5.00'), is_on_sale=False)
+    second = product_inventory_factory.create(store_price=Decimal('10.00'), is_on_sale=False)
+    phone = get_session_cart_store(rf, create_test_user)
+    laptop = get_session_cart_store(rf, create_test_user)
+    phone.add(first)
+    laptop.add(second)
+    laptop.add(second)
+
+    phone.flush()
+    laptop.flush()
+    assert [(line.sku, line.quantity) for line in laptop.get_lines()] == [(first.sku, 1), (second.sku, 2)]
+    assert models.Cart.objects.get(user=create_test_user).total_amount == Decimal('25.00')
+
+    # order of both items is placed on the laptop
+    clear_cart(create_test_user)
+    laptop.forget()
+    phone.add(second)
+    phone.flush()
+
+    assert [(line.sku, line.quantity) for line in get_database_lines(create_test_user.pk)] == [(second.sku, 1)]
+    assert [(line.sku, line.quantity) for line in phone.get_lines()] == [(second.sku, 1)]
+    assert laptop.get_lines() == []
+
+def test_cart_quantity_is_lazy_and_kept_in_session(
+        db, rf, settings, django_assert_num_queries, create_test_user, product_inventory_factory):
+    """Test that cart quantity is computed only when used and
+       read from session, updated by adding to the cart."""
+    settings.CART_STORE = 'ecommerce.cart.DatabaseCartStore'
+    product_inventory = product_inventory_factory.create()
+    request = rf.get('/')
+    SessionMiddleware(lambda r: None).process_request(request)
+    request.user = create_test_user
+
+    with django_assert_num_queries(0):
+        context = get_cart_quantity(request)
+
+    get_cart_store(request).add(product_inventory)
+    with django_assert_num_queries(0):
+        assert context['cart_quantity'] == 1
+
+
+def test_cart_taxes_are_rounded_per_line_and_refreshed(
+        db, django_assert_num_queries, create_test_user, product_inventory_factory):
+    """Test that taxes of a cart are computed from cached tax table
+       and the table is rebuilt after a tax changes."""
+    first = product_inventory_factory.create(store_price=Decimal('10.05'), is_on_sale=False)
+    second = product_inventory_factory.create(store_price=Decimal('3.33'), is_on_sale=False)
+    vat = models.Tax.objects.create(tax_type='vat', tax_percentage=23)
+    vat.product_type.add(first.product_type, second.product_type)
+    models.Tax.objects.create(tax_type='inactive', tax_percentage=50, is_active=False).product_type.add(
+        first.product_type)
+    add_to_cart(create_test_user, first)
+    add_to_cart(create_test_user, second)
+
+    get_cart_taxes(create_test_user)
+    # only order items, tax table is cached
+    with django_assert_num_queries(1):
+        taxes = get_cart_taxes(create_test_user)
+    # 2.3115 -> 2.31, 0.7659 -> 0.77
+    assert [line.amount for line in taxes.lines] == [Decimal('2.31'), Decimal('0.77')]
+    assert taxes.total == Decimal('3.08')
+
+    vat.product_type.remove(second.product_type)
+    assert get_cart_taxes(create_test_user).total == Decimal('2.31')
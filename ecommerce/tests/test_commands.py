@@ -0,0 +1,75 @@
+"""
+Tests custom Django management commands of ecommerce app
+"""
+import random
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.management import call_command
+
+from ecommerce import models
+from ecommerce.cart import SessionCartStore
+from ecommerce.management.commands import refresh_recommendations
+
+
+def test_refresh_recommendations(
+        db, create_test_user, single_category, product_factory, product_inventory_factory):
+    """Test that products sharing a category and bought together
+       are recommended, best scored first."""
+    product = product_factory.create(category=[single_category])
+    same_category = product_factory.create(category=[single_category])
+    bought_together = product_factory.create(category=[single_category])
+    unrelated = product_factory.create()
+    inventory = product_inventory_factory.create(product=product)
+    bought_together_inventory = product_inventory_factory.create(product=bought_together)
+    models.PlacedOrder.objects.create(
+        user=create_test_user,
+        order_items=[{'sku': inventory.sku, 'quantity': 1}, {'sku': bought_together_inventory.sku, 'quantity': 1}],
+        total_amount=10,
+        order_number='1',
+        order_date='2022-11-30 23:11:00',
+    )
+
+    call_command('refresh_recommendations', top=5)
+
+    recommended = list(models.ProductRecommendation.objects.filter(
+        product=product).order_by('-score').values_list('recommended_product', flat=True))
+    assert recommended == [bought_together.id, same_category.id]
+    assert not models.ProductRecommendation.objects.filter(product=unrelated).exists()
+
+
+def test_refresh_recommendations_samples_large_postings():
+    """Test that products of a large posting are paired with
+       a sample of other products, not with all of them."""
+    products = set(range(10 * refresh_recommendations.MAX_POSTING_SIZE))
+    pairs = list(refresh_recommendations.Command.get_pairs(products, random.Random(0)))
+
+    assert len(pairs) <= len(products) * refresh_recommendations.POSTING_SAMPLE_SIZE
+    assert {first for first, second in pairs} == products
+    assert all(first != second for first, second in pairs)
+
+
+def test_flush_carts(db, rf, create_test_user, product_inventory_factory):
+    """Test that carts of sessions marked as changed are written to the
+       database, also changes made after marking (which are not marked
+       again), and carts are not written again if they did not change."""
+    product_inventory = product_inventory_factory.create(store_price=Decimal('10.00'), is_on_sale=False)
+    request = rf.get('/')
+    SessionMiddleware(lambda r: None).process_request(request)
+    request.session.save()
+    request.user = create_test_user
+    cart_store = SessionCartStore(request)
+
+    for quantity in (1, 2):
+        cart_store.add(product_inventory)
+        request.session.save()
+        call_command('flush_carts')
+        order_item = models.OrderItem.objects.get(user=create_test_user)
+        assert (order_item.quantity, order_item.amount) == (quantity, Decimal('10.00') * quantity)
+    assert models.SessionCart.objects.get().revision == 2
+
+    output = StringIO()
+    call_command('flush_carts', stdout=output)
+    assert output.getvalue().startswith('0 carts')
+
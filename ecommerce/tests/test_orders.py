@@ -0,0 +1,66 @@
+"""Tests for order placement of ecommerce app."""
+from decimal import Decimal
+
+import pytest
+
+from ecommerce import models
+from ecommerce.cart import add_to_cart
+from ecommerce.orders import place_order, OutOfStockError
+from ecommerce.utils import get_cache_version, CATALOG_VERSION_KEY
+from search.models import SearchIndexOutbox
+
+
+@pytest.fixture
+def order(create_test_user):
+    return models.Order.objects.create(
+        user=create_test_user, order_number='1', first_name='first', last_name='last', email='test@example.com',
+        address='address', city='city', pin_code='00-000', total=0, total_tax=0, payment_method='PayPal')
+
+
+def test_place_order_updates_stock_and_clears_cart(db, create_test_user, order, product_inventory_factory,
+                                                   stock_factory):
+    """Test that placing an order updates stock of every product, queues
+       the products for reindexing and invalidates only their pages, stores
+       the order and clears the cart, and placing it again does nothing."""
+    first = product_inventory_factory.create(store_price=Decimal('10.00'), is_on_sale=False)
+    second = product_inventory_factory.create(store_price=Decimal('5.00'), is_on_sale=False)
+    stock_factory.create(product_inventory=first, units=5, units_sold=0)
+    stock_factory.create(product_inventory=second, units=1, units_sold=0)
+    add_to_cart(create_test_user, first)
+    add_to_cart(create_test_user, first)
+    add_to_cart(create_test_user, second)
+    SearchIndexOutbox.objects.all().delete()
+    catalog_version = get_cache_version(CATALOG_VERSION_KEY)
+    updated_at = dict(models.Product.objects.values_list('id', 'updated_at'))
+
+    placed_order = place_order(create_test_user, order)
+
+    assert placed_order.total_amount == Decimal('25.00')
+    assert list(models.Stock.objects.order_by('product_inventory_id').values_list('units', 'units_sold')) == [
+        (3, 2), (0, 1)]
+    assert not models.OrderItem.objects.filter(user=create_test_user).exists()
+    assert models.Cart.objects.get(user=create_test_user).quantity == 0
+    assert sorted(SearchIndexOutbox.objects.values_list('model', 'object_pk')) == [
+        ('ecommerce.productinventory', str(first.pk)), ('ecommerce.productinventory', str(second.pk))]
+    assert get_cache_version(CATALOG_VERSION_KEY) == catalog_version
+    assert all(models.Product.objects.get(id=product_id).updated_at > updated_at[product_id]
+               for product_id in (first.product_id, second.product_id))
+    assert place_order(create_test_user, order) is None
+
+
+def test_place_order_does_not_oversell(db, create_test_user, order, product_inventory_factory, stock_factory):
+    """Test that an order with a sold out product changes nothing."""
+    available = product_inventory_factory.create()
+    sold_out = product_inventory_factory.create()
+    stock_factory.create(product_inventory=available, units=5, units_sold=0)
+    stock_factory.create(product_inventory=sold_out, units=0, units_sold=3)
+    add_to_cart(create_test_user, available)
+    add_to_cart(create_test_user, sold_out)
+
+    with pytest.raises(OutOfStockError) as error:
+        place_order(create_test_user, order)
+
+    assert error.value.skus == [sold_out.sku]
+    assert models.Stock.objects.get(product_inventory=available).units == 5
+    assert models.OrderItem.objects.filter(user=create_test_user).count() == 2
+    assert not models.PlacedOrder.objects.exists()
@@ -0,0 +1,241 @@
+"""Tests for helper functions of ecommerce app."""
+
+import base64
+
+import pytest
+from django.core.management import call_command
+from django.http import QueryDict
+
+from ecommerce import models
+from ecommerce.utils import get_product_cards, get_categories_with_parents_and_children, get_filters, \
+    get_random_sample, keyset_paginate, get_filtered_queryset, update_attribute_values_index, \
+    encode_cursor, decode_cursor, get_cache_version, get_indexed_attribute_values, ATTRIBUTE_POSTINGS_VERSION_KEY
+
+
+@pytest.mark.parametrize('number_of_products', [1, 5])
+def test_get_product_cards_constant_number_of_queries(
+        db, django_assert_num_queries, product_inventory_factory, stock_factory,
+        media_factory, product_attribute_value_factory, number_of_products):
+    """Test that product cards are fetched with the same number
+       of queries, no matter how many products there are."""
+    for _ in range(number_of_products):
+        product_inventory = product_inventory_factory.create()
+        stock_factory.create(product_inventory=product_inventory, units=3)
+        media_factory.create(product_inventory=product_inventory)
+        product_inventory.attribute_values.add(product_attribute_value_factory.create())
+
+    # products inventories with stock, featured images and attribute values
+    with django_assert_num_queries(3):
+        products_data = get_product_cards(models.ProductInventory.objects.all())
+
+    assert len(products_data) == number_of_products
+    for product_inventory, units, image, attribute_values in products_data:
+        assert units == 3
+        assert image.is_feature
+        assert len(attribute_values) == 1
+
+
+def test_attribute_values_index_is_updated(
+        db, product_inventory_factory, product_attribute_factory, product_attribute_value_factory):
+    """Test that the attribute values index is updated when
+       attribute values are added or removed."""
+    product_inventory = product_inventory_factory.create()
+    sibling = product_inventory_factory.create(product=product_inventory.product)
+    attribute = product_attribute_factory.create(name='size')
+    small = product_attribute_value_factory.create(product_attribute=attribute, attribute_value='s')
+    extra_small = product_attribute_value_factory.create(product_attribute=attribute, attribute_value='xs')
+
+    product_inventory.attribute_values.add(small)
+    sibling.attribute_values.add(extra_small)
+    index = models.ProductAttributeValuesIndex.objects.get(product=product_inventory.product)
+    assert index.attribute_values == {'size': ['xs', 's']}
+
+    sibling.attribute_values.remove(extra_small)
+    index.refresh_from_db()
+    assert index.attribute_values == {'size': ['s']}
+
+
+def test_update_attribute_values_index_upserts_rows(
+        db, product_inventory_factory, product_attribute_factory, product_attribute_value_factory):
+    """Test that indexing already indexed products updates their rows."""
+    product_inventory = product_inventory_factory.create()
+    product_id = product_inventory.product_id
+    models.ProductAttributeValuesIndex.objects.filter(product_id=product_id).delete()
+
+    assert update_attribute_values_index([product_id]) == {}
+    models.ProductAttributeValues.objects.create(
+        productinventory=product_inventory,
+        attributevalues=product_attribute_value_factory.create(
+            product_attribute=product_attribute_factory.create(name='color'), attribute_value='red'))
+    update_attribute_values_index([product_id])
+
+    index = models.ProductAttributeValuesIndex.objects.get(product_id=product_id)
+    assert index.attribute_values == {'color': ['red']}
+
+
+
+def test_indexed_attribute_values_are_not_written_on_read(
+        db, product_inventory_factory, product_attribute_factory, product_attribute_value_factory):
+    """Test that values of products missing from the index are computed
+       without writing the index, which is backfilled by a command."""
+    product_inventory = product_inventory_factory.create()
+    product_inventory.attribute_values.add(product_attribute_value_factory.create(
+        product_attribute=product_attribute_factory.create(name='color'), attribute_value='red'))
+    models.ProductAttributeValuesIndex.objects.all().delete()
+
+    assert get_indexed_attribute_values([product_inventory.product_id]) == {
+        product_inventory.product_id: {'color': ['red']}}
+    assert not models.ProductAttributeValuesIndex.objects.exists()
+
+    call_command('refresh_attribute_values_index')
+    index = models.ProductAttributeValuesIndex.objects.get(product_id=product_inventory.product_id)
+    assert index.attribute_values == {'color': ['red']}
+
+def test_attribute_postings_version_changes_only_with_links(
+        db, product_inventory_factory, product_attribute_value_factory):
+    """Test that posting lists are not invalidated by a price edit."""
+    product_inventory = product_inventory_factory.create()
+    version = get_cache_version(ATTRIBUTE_POSTINGS_VERSION_KEY)
+
+    product_inventory.store_price = 11
+    product_inventory.save()
+    assert get_cache_version(ATTRIBUTE_POSTINGS_VERSION_KEY) == version
+
+    product_inventory.attribute_values.add(product_attribute_value_factory.create())
+    assert get_cache_version(ATTRIBUTE_POSTINGS_VERSION_KEY) != version
+
+
+def test_category_tree_is_invalidated(db, category_with_child):
+    """Test that cached category tree supports more than two levels
+       and is rebuilt after a category is saved."""
+    tree = get_categories_with_parents_and_children()
+    assert next(node for node in tree if node['slug'] == 'parent')['children'][0]['children'] == []
+
+    category_with_child.children.create(name='grandchild', slug='grandchild')
+    tree = get_categories_with_parents_and_children()
+    parent = next(node for node in tree if node['slug'] == 'parent')
+    assert parent['children'][0]['children'][0]['slug'] == 'grandchild'
+    assert parent['children'][0]['children'][0]['level'] == 2
+
+
+def test_get_filters_returns_facet_counts(
+        db, single_category, product_factory, product_inventory_factory,
+        product_attribute_factory, product_attribute_value_factory):
+    """Test that filters come with number of products
+       and are refreshed when attribute values change."""
+    product = product_factory.create(category=[single_category])
+    first = product_inventory_factory.create(product=product)
+    second = product_inventory_factory.create(product=product)
+    color = product_attribute_factory.create(name='color')
+    red = product_attribute_value_factory.create(product_attribute=color, attribute_value='red')
+    blue = product_attribute_value_factory.create(product_attribute=color, attribute_value='blue')
+
+    first.attribute_values.add(red)
+    second.attribute_values.add(red)
+    assert get_filters(single_category.slug) == {'color': [('red', 2)]}
+
+    second.attribute_values.add(blue)
+    assert get_filters(single_category.slug) == {'color': [('blue', 1), ('red', 2)]}
+    assert get_filters()['color'] == [('blue', 1), ('red', 2)]
+
+
+def test_facet_counts_are_updated_by_deltas(
+        db, django_assert_num_queries, single_category, product_factory, product_inventory_factory,
+        product_attribute_factory, product_attribute_value_factory):
+    """Test that facet counts follow removed attribute values and moved
+       inventories and a category without facets is computed only once."""
+    other_category = models.Category.objects.create(name='other', slug='other')
+    product_inventory = product_inventory_factory.create(product=product_factory.create(category=[single_category]))
+    color = product_attribute_factory.create(name='color')
+    red = product_attribute_value_factory.create(product_attribute=color, attribute_value='red')
+    blue = product_attribute_value_factory.create(product_attribute=color, attribute_value='blue')
+    assert get_filters(single_category.slug) == {}
+
+    product_inventory.attribute_values.add(red, blue)
+    product_inventory.attribute_values.remove(blue)
+    assert get_filters(single_category.slug) == {'color': [('red', 1)]}
+    assert get_filters() == {'color': [('red', 1)]}
+
+    product_inventory.product = product_factory.create(category=[other_category])
+    product_inventory.save()
+    assert get_filters(single_category.slug) == {}
+    assert get_filters(other_category.slug) == {'color': [('red', 1)]}
+    assert get_filters() == {'color': [('red', 1)]}
+
+    # category and its (empty) facet counts
+    with django_assert_num_queries(2):
+        get_filters(single_category.slug)
+
+
+def test_get_random_sample(db, single_category, product_factory):
+    """Test that random sample contains only objects matching filters."""
+    in_category = [product_factory.create(category=[single_category]) for _ in range(5)]
+    product_factory.create()
+    product_factory.create(category=[single_category], is_active=False)
+
+    sample = get_random_sample(models.Product, 3, category=single_category.id, is_active=True)
+    assert len(sample) == 3
+    assert set(sample) <= set(in_category)
+
+
+@pytest.mark.parametrize('sort, prices', [
+    ('price_asc', [10, 20, 20, 30, 40]),
+    ('price_desc', [40, 30, 20, 20, 10]),
+])
+def test_keyset_paginate(db, product_inventory_factory, sort, prices):
+    """Test that following cursors returns every product once, in order."""
+    for price in [20, 40, 10, 30, 20]:
+        product_inventory_factory.create(store_price=price)
+
+    products_data, cursor = keyset_paginate(models.ProductInventory.objects.all(), sort=sort, page_size=2)
+    pages = [products_data]
+    while cursor:
+        products_data, cursor = keyset_paginate(
+            models.ProductInventory.objects.all(), sort=sort, cursor=cursor, page_size=2)
+        pages.append(products_data)
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [product_data[0].store_price for page in pages for product_data in page] == prices
+
+
+@pytest.mark.parametrize('cursor', [
+    base64.urlsafe_b64encode(b'[{"a": 1}, 1]').decode(),
+    base64.urlsafe_b64encode(b'[["2022-01-01"], 1]').decode(),
+    base64.urlsafe_b64encode(b'["2022-01-01", "x"]').decode(),
+    base64.urlsafe_b64encode(b'7').decode(),
+    'not base64',
+])
+def test_decode_cursor_rejects_crafted_cursors(cursor):
+    assert decode_cursor(cursor) is None
+
+
+def test_keyset_paginate_ignores_crafted_cursor(db, product_inventory_factory):
+    """Test that a cursor with a value that is not a string starts from the first page."""
+    product_inventory_factory.create()
+    cursor = base64.urlsafe_b64encode(b'[{"a": 1}, 1]').decode()
+    products_data, next_cursor = keyset_paginate(models.ProductInventory.objects.all(), cursor=cursor)
+    assert len(products_data) == 1
+    assert decode_cursor(encode_cursor('2022-01-01', 1)) == ('2022-01-01', 1)
+
+
+def test_get_filtered_queryset_or_within_and_across_attributes(
+        db, product_inventory_factory, product_attribute_factory, product_attribute_value_factory):
+    """Test that values of one attribute are combined with OR
+       and different attributes are combined with AND."""
+    color = product_attribute_factory.create(name='color')
+    size = product_attribute_factory.create(name='size')
+    red = product_attribute_value_factory.create(product_attribute=color, attribute_value='red')
+    blue = product_attribute_value_factory.create(product_attribute=color, attribute_value='blue')
+    small = product_attribute_value_factory.create(product_attribute=size, attribute_value='s')
+    large = product_attribute_value_factory.create(product_attribute=size, attribute_value='l')
+
+    red_small = product_inventory_factory.create()
+    red_small.attribute_values.add(red, small)
+    blue_small = product_inventory_factory.create()
+    blue_small.attribute_values.add(blue, small)
+    red_large = product_inventory_factory.create()
+    red_large.attribute_values.add(red, large)
+
+    request_get = QueryDict('color=red&color=blue&size=s&query=shirt')
+    queryset = get_filtered_queryset(request_get, products=models.ProductInventory.objects.all())
+    assert set(queryset) == {red_small, blue_small}
@@ -0,0 +1,49 @@
+"""Tests for views of ecommerce app."""
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce import models
+
+
+def test_product_details_recommendations_are_kept_in_snapshot(
+        db, client, single_category, product_factory, product_inventory_factory, stock_factory):
+    """Test that repeated views of a product do not query products for
+       'You might also like' section."""
+    product = product_factory.create(slug='viewed-product', category=[single_category])
+    product_inventory_factory.create(product=product)
+    for i in range(4):
+        recommended_product = product_factory.create(slug=f'recommended-{i}', category=[single_category])
+        stock_factory.create(product_inventory=product_inventory_factory.create(product=recommended_product))
+        models.ProductRecommendation.objects.create(product=product, recommended_product=recommended_product, score=1)
+
+    response = client.get(f'/shop/products/{product.slug}/')
+    assert len(response.context['three_products']) == 3
+
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(f'/shop/products/{product.slug}/')
+    assert len(response.context['three_products']) == 3
+    # only updated_at of the product (a part of the snapshot key) is queried
+    product_queries = [query for query in context.captured_queries if 'ecommerce_product' in query['sql']]
+    assert len(product_queries) == 1
+    assert 'updated_at' in product_queries[0]['sql']
+
+
+def test_product_details_snapshot_is_refreshed_when_stock_changes(
+        db, client, product_factory, product_inventory_factory, stock_factory):
+    """Test that product page snapshot is dropped when stock of the product changes."""
+    product = product_factory.create(slug='viewed-product')
+    stock = stock_factory.create(product_inventory=product_inventory_factory.create(product=product), units=5)
+    other_stock = stock_factory.create(units=5)
+    response = client.get(f'/shop/products/{product.slug}/')
+    assert response.context['products_data'][0][2] == 5
+
+    other_stock.units = 1
+    other_stock.save()
+    with CaptureQueriesContext(connection) as context:
+        client.get(f'/shop/products/{product.slug}/')
+    assert len([query for query in context.captured_queries if 'ecommerce_product' in query['sql']]) == 1
+
+    stock.units = 4
+    stock.save()
+    response = client.get(f'/shop/products/{product.slug}/')
+    assert response.context['products_data'][0][2] == 4
@@ -1,13 +1,47 @@
 """Helper functions for views in ecommerce app."""
 from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.core.mail import EmailMessage
-from django.shortcuts import get_object_or_404
+from django.db import connections, transaction
+from django.db.models import Count, F, Prefetch, Q
+from django.db.models.functions import Greatest
 from django.conf import settings
 from django.template.loader import render_to_string
+from django.utils import timezone
 
-from ecommerce.models import ProductAttributeValues, Category, ProductInventory, Media, Stock
+from ecommerce.models import ProductAttributeValues, Category, ProductInventory, Media, Stock, Product, \
+    ProductAttributeValuesIndex, CategoryFacetCount, ProductAttributeValue
 
+import base64
 import datetime
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ATTRIBUTE_POSTINGS_VERSION_KEY = 'attribute_postings_version'
+CATALOG_VERSION_KEY = 'catalog_version'
+CATEGORY_TREE_VERSION_KEY = 'category_tree_version'
+RECOMMENDATIONS_VERSION_KEY = 'recommendations_version'
+TAX_TABLE_VERSION_KEY = 'tax_table_version'
+CATEGORY_TREE_TIMEOUT = 60 * 60 * 24
+RANDOM_POOL_TIMEOUT = 60 * 5
+NOT_FILTER_PARAMETERS = ('query', 'sort', 'cursor', 'page')
+# {sort: (field, descending)}
+KEYSET_SORTING = {
+    'newest': ('updated_at', True),
+    'price_asc': ('store_price', False),
+    'price_desc': ('store_price', True),
+}
+
+# sends email notifications in the background
+NOTIFICATION_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix='notification')
+
+# in-process pools of ids used for random sampling, {key: (expiry time, ids)}
+_random_pools = {}
+# in-process posting lists of attribute values, {'version': ..., 'postings': ...}
+_attribute_postings = {}
 
 
 def size_sorting_key(element):
@@ -16,36 +50,10 @@ def size_sorting_key(element):
     return sizes.index(element)
 
 
-def get_all_products_attribute_values(product_inventory):
-    """Gets and returns attribute values for products
-       inventories to display with all other data. It gets
-       ProductInventory as an argument but then gets
-       all Product objects related to it - to get all
-       attribute values, bot just the ones connected to
-       this ProductInventory."""
-    product = product_inventory.product
-    all_products_inventories = ProductInventory.objects.filter(product=product)
-    attribute_values = {}
-
-    for prod_inv in all_products_inventories:
-        values = ProductAttributeValues.objects.filter(productinventory=prod_inv).distinct()
-        for v in values:
-            attr_name, attr_value = str(v).split(' : ')[:2]
-            if attr_name not in attribute_values:
-                attribute_values[attr_name] = set([])
-            attribute_values[attr_name].add(attr_value)
-
-    # sorting sizes
-    if 'size' in attribute_values:
-        attribute_values['size'] = sorted(attribute_values['size'], key=size_sorting_key)
-
-    return attribute_values
-
-
 def get_specific_attribute_values(product_inventory):
     """Gets and returns ProductAttributeValues for a specific
        ProductInventory, not all values associated with this Product
-       like function get_all_products_attribute_values."""
+       like function get_indexed_attribute_values."""
     attribute_values = {}
     values = ProductAttributeValues.objects.filter(productinventory=product_inventory)
 
@@ -58,97 +66,434 @@ def get_specific_attribute_values(product_inventory):
     return attribute_values
 
 
-def get_categories_with_parents_and_children():
-    """Helper function for getting categories, but with
-       distinction, which categories are parents and which
-       ones are children."""
-    categories = Category.objects.filter(is_active=True)
-    categories_dict = {}
+def get_specific_attribute_values_for_inventories(product_inventory_ids) -> dict[int: dict[str: str]]:
+    """Gets and returns ProductAttributeValues of many ProductInventory objects
+       with one query - {product inventory id: {attribute name: attribute value}}."""
+    attribute_values = {}
+    values = ProductAttributeValues.objects.filter(productinventory_id__in=product_inventory_ids).values_list(
+        'productinventory_id', 'attributevalues__product_attribute__name', 'attributevalues__attribute_value')
+
+    for product_inventory_id, attr_name, attr_value in values:
+        attribute_values.setdefault(product_inventory_id, {})[attr_name] = attr_value
+
+    return attribute_values
+
+
+def get_attribute_values_for_products(product_ids) -> dict[int: dict[str: list]]:
+    """Computes and returns attribute values of all products with given ids
+       using one query. Keys of the returned dict are products ids and
+       values are dicts {attribute name: sorted attribute values}."""
+    values = ProductAttributeValues.objects.filter(
+        productinventory__product_id__in=product_ids).values_list(
+        'productinventory__product_id',
+        'attributevalues__product_attribute__name',
+        'attributevalues__attribute_value').distinct()
 
-    for category in categories:
-        if not category.parent:
-            categories_dict.update({
-                category: []
-            })
-        else:
-            categories_dict[category.parent].append(category)
+    attribute_values = {}
+    for product_id, attr_name, attr_value in values:
+        product_values = attribute_values.setdefault(product_id, {})
+        product_values.setdefault(attr_name, set()).add(attr_value)
+
+    for product_values in attribute_values.values():
+        for attr_name, attr_values in product_values.items():
+            if attr_name == 'size':
+                product_values[attr_name] = sorted(attr_values, key=size_sorting_key)
+            else:
+                product_values[attr_name] = sorted(attr_values)
+
+    return attribute_values
+
+
+def update_attribute_values_index(product_ids) -> dict[int: dict[str: list]]:
+    """Recomputes and saves ProductAttributeValuesIndex rows
+       for products with given ids. Returns the new values."""
+    product_ids = set(product_ids)
+    attribute_values = get_attribute_values_for_products(product_ids)
+    existing_ids = Product.objects.filter(id__in=product_ids).values_list('id', flat=True)
+    ProductAttributeValuesIndex.objects.bulk_create(
+        [ProductAttributeValuesIndex(product_id=product_id, attribute_values=attribute_values.get(product_id, {}))
+         for product_id in existing_ids],
+        update_conflicts=True,
+        # attnames - Django 4.1 puts these names into ON CONFLICT clause as they are
+        unique_fields=['product_id'],
+        update_fields=['attribute_values']
+    )
+    return attribute_values
+
+
+def get_indexed_attribute_values(product_ids) -> dict[int: dict[str: list]]:
+    """Gets and returns attribute values of products with given ids
+       from ProductAttributeValuesIndex. Values of products that are
+       not indexed yet are computed, but not saved - the index is
+       written by signals and refresh_attribute_values_index command."""
+    product_ids = set(product_ids)
+    attribute_values = dict(ProductAttributeValuesIndex.objects.filter(
+        product_id__in=product_ids).values_list('product_id', 'attribute_values'))
+
+    missing_ids = product_ids - attribute_values.keys()
+    if missing_ids:
+        attribute_values.update(get_attribute_values_for_products(missing_ids))
+
+    return attribute_values
+
+
+def get_product_cards(product_inventories) -> list[tuple]:
+    """Gets and returns data needed to display products inventories
+       as product cards - list of tuples (product_inventory, units, image,
+       attribute_values). It takes ProductInventory queryset and uses
+       a constant number of queries, no matter how many products
+       there are in the queryset."""
+    product_inventories = list(product_inventories.select_related('product', 'product_inventory').prefetch_related(
+        Prefetch('media_product_inventory',
+                 queryset=Media.objects.filter(is_feature=True),
+                 to_attr='featured_images')))
+    attribute_values = get_indexed_attribute_values(
+        {product_inventory.product_id for product_inventory in product_inventories})
+
+    products_data = []
+    for product_inventory in product_inventories:
+        try:
+            units = product_inventory.product_inventory.units
+        except Stock.DoesNotExist:
+            units = 0
+        image = product_inventory.featured_images[0] if product_inventory.featured_images else None
+        data = (product_inventory, units, image, attribute_values.get(product_inventory.product_id, {}))
+        products_data.append(data)
+    return products_data
+
+
+def get_cache_version(key: str) -> int:
+    """Gets and returns current version stored in cache under 'key'.
+       Versions are parts of keys of cached data, so bumping
+       a version invalidates all data cached with it."""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(key: str):
+    """Invalidates data cached with version stored under 'key'."""
+    try:
+        cache.incr(key)
+    except ValueError:  # there is no version yet (or it was evicted)
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def touch_products(product_ids):
+    """Sets updated_at of products with given ids (or queryset of ids) to now.
+       It is a part of keys of cached product pages, so it is changed
+       whenever anything displayed on the page changes."""
+    Product.objects.filter(id__in=product_ids).update(updated_at=timezone.now())
 
-    return categories_dict
 
+def build_category_tree() -> list[dict]:
+    """Builds and returns tree of active categories using one query.
+       Every node is a dict with 'name', 'slug', 'level' and 'children'
+       (list of nodes) keys. Categories with inactive ancestor are skipped."""
+    categories = Category.objects.filter(is_active=True).order_by('tree_id', 'lft').values(
+        'id', 'name', 'slug', 'level', 'parent_id')
+    nodes = {}
+    tree = []
 
-def get_filters(slug: str = None) -> dict[str: str]:
-    """Method gets and returns filters. If argument 'slug' is passed,
-       function will return filters appropriate to category with that slug.
-       If 'slug' will be left as None - function will return all filters."""
+    # ordering by tree_id and lft guarantees that parents come before their children
+    for category in categories:
+        node = dict(category, children=[])
+        if node['parent_id'] is None:
+            tree.append(node)
+        elif node['parent_id'] in nodes:
+            nodes[node['parent_id']]['children'].append(node)
+        else:
+            continue
+        nodes[node['id']] = node
+
+    return tree
+
+
+def get_first_inventories(products):
+    """Gets and returns queryset of the first ProductInventory
+       of every product in 'products'."""
+    first_inventories_ids = ProductInventory.objects.filter(product__in=products).order_by(
+        'product_id', 'id').distinct('product_id').values('id')
+    return ProductInventory.objects.filter(id__in=first_inventories_ids)
+
+
+def get_categories_with_parents_and_children() -> list[dict]:
+    """Helper function for getting tree of categories (see
+       build_category_tree). Tree is cached and rebuilt only
+       after a Category was saved or deleted."""
+    key = f'category_tree:{get_cache_version(CATEGORY_TREE_VERSION_KEY)}'
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_category_tree()
+        cache.set(key, tree, timeout=CATEGORY_TREE_TIMEOUT)
+    return tree
+
+
+def update_facet_counts(category_ids):
+    """Recomputes CategoryFacetCount rows of categories with given ids
+       (None stands for all products), one grouped query per category,
+       and marks the categories as computed."""
+    category_ids = set(category_ids)
+    for category_id in category_ids:
+        if category_id is None:
+            product_inventories = ProductInventory.objects.all()
+        else:
+            product_inventories = ProductInventory.objects.filter(product__category=category_id)
+        counts = product_inventories.filter(attribute_values__isnull=False).values(
+            'attribute_values').annotate(product_count=Count('id', distinct=True))
+
+        with transaction.atomic():
+            CategoryFacetCount.objects.filter(category_id=category_id).delete()
+            CategoryFacetCount.objects.bulk_create([
+                CategoryFacetCount(category_id=category_id,
+                                   attribute_value_id=count['attribute_values'],
+                                   product_count=count['product_count'])
+                for count in counts
+            ])
+    Category.objects.filter(id__in=category_ids - {None}).update(facet_counts_computed=True)
+
+
+def apply_facet_count_deltas(deltas: dict[tuple[int, int]: int]):
+    """Adds {(category id, attribute value id): delta} to product counts
+       of CategoryFacetCount rows, creating missing rows and deleting rows
+       that dropped to zero. Attribute values are locked (in order of ids),
+       so concurrent changes of counts of the same value are serialized."""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    value_ids = sorted({value_id for _, value_id in deltas})
+    with transaction.atomic():
+        list(ProductAttributeValue.objects.select_for_update().filter(
+            id__in=value_ids).order_by('id').values_list('id', flat=True))
+        for (category_id, value_id), delta in deltas.items():
+            updated = CategoryFacetCount.objects.filter(category_id=category_id, attribute_value_id=value_id).update(
+                product_count=Greatest(F('product_count') + delta, 0))
+            if not updated and delta > 0:
+                CategoryFacetCount.objects.create(category_id=category_id, attribute_value_id=value_id,
+                                                  product_count=delta)
+        CategoryFacetCount.objects.filter(attribute_value_id__in=value_ids, product_count=0).delete()
+
+
+def update_facet_counts_of_links(links, delta: int, all_products: bool = True):
+    """Adds 'delta' to facet counts of links - (product id, attribute value id)
+       pairs, one for every ProductInventory of the product that gained
+       (delta=1) or lost (delta=-1) the attribute value - in categories
+       of the product and (if 'all_products') in facet counts of all products."""
+    links = list(links)
+    if not links:
+        return
+    categories = {}
+    for product_id, category_id in Product.category.through.objects.filter(
+            product_id__in={product_id for product_id, _ in links}).values_list('product_id', 'category_id'):
+        categories.setdefault(product_id, []).append(category_id)
+
+    deltas = {}
+    for product_id, value_id in links:
+        for category_id in categories.get(product_id, []) + ([None] if all_products else []):
+            deltas[category_id, value_id] = deltas.get((category_id, value_id), 0) + delta
+    apply_facet_count_deltas(deltas)
+
+
+def get_random_pool(model, **filters) -> list[int]:
+    """Gets and returns ids of model objects matching filters. Ids
+       are kept in memory of the process and refreshed every
+       RANDOM_POOL_TIMEOUT seconds, so usually no query is needed."""
+    key = (model._meta.label, tuple(sorted(filters.items())))
+    pool = _random_pools.get(key)
+    if pool is None or pool[0] < time.monotonic():
+        ids = list(model.objects.filter(**filters).values_list('id', flat=True))
+        pool = (time.monotonic() + RANDOM_POOL_TIMEOUT, ids)
+        _random_pools[key] = pool
+    return pool[1]
+
+
+def get_random_sample(model, k: int, **filters) -> list:
+    """Gets and returns up to k random model objects matching filters
+       (filters values have to be hashable, e.g. pass category=category.id).
+       It is a replacement for order_by('?') - instead of sorting the
+       whole table, it samples ids from an in-memory pool and fetches
+       only the chosen objects by primary key."""
+    pool = get_random_pool(model, **filters)
+    # take more ids than needed, in case some objects changed since the pool was built
+    ids = random.sample(pool, min(len(pool), k * 2))
+    objects = list(model.objects.filter(id__in=ids, **filters))
+    random.shuffle(objects)
+    return objects[:k]
+
+
+def get_filters(slug: str = None) -> dict[str: list[tuple[str, int]]]:
+    """Method gets and returns filters with number of products for every
+       value - {attribute name: [(attribute value, count), ...]}. If argument
+       'slug' is passed, function will return filters appropriate to category
+       with that slug. If 'slug' will be left as None - function will return
+       all filters. Counts are read from CategoryFacetCount."""
     if slug:
-        attrs = ProductInventory.objects.filter(product__category__slug=slug).values(
-            'attribute_values__product_attribute__name', 'attribute_values__attribute_value').distinct()
+        categories = dict(Category.objects.filter(slug=slug).values_list('id', 'facet_counts_computed'))
+        not_computed_ids = [category_id for category_id, computed in categories.items() if not computed]
+        if not_computed_ids:
+            update_facet_counts(not_computed_ids)
+        facet_counts = CategoryFacetCount.objects.filter(category_id__in=categories)
     else:
-        attrs = ProductInventory.objects.all().values(
-            'attribute_values__product_attribute__name', 'attribute_values__attribute_value').distinct()
+        facet_counts = CategoryFacetCount.objects.filter(category__isnull=True)
+    facet_counts = facet_counts.values_list(
+        'attribute_value__product_attribute__name', 'attribute_value__attribute_value', 'product_count')
+
+    counts = {}
+    for attr_name, attr_value, product_count in facet_counts:
+        values = counts.setdefault(attr_name, {})
+        values[attr_value] = values.get(attr_value, 0) + product_count
 
+    return sort_filters(counts)
+
+
+def sort_filters(counts: dict[str: dict[str: int]]) -> dict[str: list[tuple[str, int]]]:
+    """Turns {attribute name: {attribute value: count}} into filters
+       {attribute name: [(attribute value, count), ...]} with sorted values."""
     filters = {}
-    attr_name = 'attribute_values__product_attribute__name'
-    attr_value = 'attribute_values__attribute_value'
-
-    for attr in attrs:
-        if attr[attr_name] in filters:
-            value = filters.get(attr[attr_name])
-            value.append(attr[attr_value])
-            filters[attr[attr_name]] = value
+    for attr_name, values in counts.items():
+        if attr_name == 'size':
+            filters[attr_name] = sorted(values.items(), key=lambda value: size_sorting_key(value[0]))
         else:
-            filters[attr[attr_name]] = [attr[attr_value]]
-
-    # sorting sizes
-    if 'size' in filters:
-        values = filters.get('size')
-        values.sort(key=size_sorting_key)
-        filters['size'] = values
+            filters[attr_name] = sorted(values.items())
 
     return filters
 
 
-def get_queryset_with_filters(request_get, slug=None, products=None) -> list[tuple]:
-    """Method gets and returns products with applied filters.
-       If the filters are checked - it will return filtered data,
-       if not - it will return all products that are associated
-       with this category - if the 'slug' argument was passed,
-       on the other hand - if 'products' was passed, function will
-       apply filters to this queryset.
-       Required is passing 'request_get' with either 'slug' or 'products'."""
-
-    if not slug and not products:
+def build_attribute_postings() -> dict[str: dict[str: frozenset]]:
+    """Builds and returns inverted index of attribute values - posting lists
+       {attribute name: {attribute value: ids of ProductInventory objects}}."""
+    postings = {}
+    values = ProductAttributeValues.objects.values_list(
+        'attributevalues__product_attribute__name', 'attributevalues__attribute_value', 'productinventory_id')
+    for attr_name, attr_value, product_inventory_id in values.iterator():
+        postings.setdefault(attr_name, {}).setdefault(attr_value, set()).add(product_inventory_id)
+
+    return {attr_name: {attr_value: frozenset(ids) for attr_value, ids in attr_values.items()}
+            for attr_name, attr_values in postings.items()}
+
+
+def get_attribute_postings() -> dict[str: dict[str: frozenset]]:
+    """Gets and returns posting lists (see build_attribute_postings).
+       They are kept in memory of the process and rebuilt only
+       after attribute values of products changed."""
+    version = get_cache_version(ATTRIBUTE_POSTINGS_VERSION_KEY)
+    if _attribute_postings.get('version') != version:
+        _attribute_postings['postings'] = build_attribute_postings()
+        _attribute_postings['version'] = version
+    return _attribute_postings['postings']
+
+
+def get_filtered_product_inventory_ids(filters: dict[str: list[str]]) -> set | None:
+    """Gets and returns ids of ProductInventory objects matching filters
+       {attribute name: [attribute values]} - any of the values of an attribute
+       (OR) and every attribute (AND). Filters are resolved in memory by
+       intersecting posting lists. Attributes that do not exist are ignored,
+       if none of them exists, None is returned (nothing to filter)."""
+    postings = get_attribute_postings()
+    matching = []
+    for attr_name, attr_values in filters.items():
+        if attr_name not in postings:
+            continue
+        ids = set()
+        for attr_value in attr_values:
+            ids |= postings[attr_name].get(attr_value, frozenset())
+        matching.append(ids)
+
+    if not matching:
+        return None
+
+    # starting from the smallest set makes intersection cheaper
+    matching.sort(key=len)
+    return matching[0].intersection(*matching[1:])
+
+
+def get_request_filters(request_get) -> dict[str: list[str]]:
+    """Gets and returns filters checked by user {attribute name: [attribute values]}
+       from GET parameters, skipping parameters connected to searching, sorting
+       or paginating."""
+    return {key: request_get.getlist(key) for key in request_get if key not in NOT_FILTER_PARAMETERS}
+
+
+def get_filtered_queryset(request_get, slug=None, products=None):
+    """Method gets and returns ProductInventory queryset with applied
+       filters. If the filters are checked - it will return filtered
+       queryset, if not - it will return all products that are associated
+       with this category - if the 'slug' argument was passed, on the
+       other hand - if 'products' was passed, function will apply filters
+       to this queryset. Required is passing 'request_get' with either
+       'slug' or 'products'."""
+
+    if not slug and products is None:
         raise TypeError('Not enough arguments - required is either slug or products.')
-    elif slug and products:
+    elif slug and products is not None:
         raise TypeError('Too many arguments - required is either slug or products.')
 
-    filter_arguments = []
     if slug:
         filtered_products = ProductInventory.objects.filter(product__category__slug=slug)
     else:
         filtered_products = products
 
-    if request_get:  # there are filters to apply
-        for key, value in request_get.items():
-            if key != 'query':  # query is connected to searching, not filtering
-                filter_arguments.append(value)
+    filters = get_request_filters(request_get)
 
-        from django.db.models import Count
+    if filters:  # there are filters to apply
+        product_inventory_ids = get_filtered_product_inventory_ids(filters)
+        if product_inventory_ids is not None:
+            filtered_products = filtered_products.filter(id__in=product_inventory_ids)
 
-        filtered_products = filtered_products.filter(
-            attribute_values__attribute_value__in=filter_arguments).annotate(
-            num_tags=Count('attribute_values')).filter(num_tags=len(filter_arguments))
+    return filtered_products
 
-    products_data = []
-    for product_inventory in filtered_products:
-        units = get_object_or_404(Stock, product_inventory=product_inventory).units
-        image = Media.objects.filter(product_inventory=product_inventory, is_feature=True)
-        if image:
-            image = image[0]
-        attribute_values = get_all_products_attribute_values(product_inventory)
-        data = (product_inventory, units, image, attribute_values)
-        products_data.append(data)
-    return products_data
+
+def encode_cursor(value, pk: int) -> str:
+    """Encodes position of the last object on a page (value of the sorting
+       field and primary key) into a URL safe string."""
+    return base64.urlsafe_b64encode(json.dumps([str(value), pk]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, int] | None:
+    """Decodes cursor created by encode_cursor. Returns None if it is invalid."""
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(value, str):  # encode_cursor always stores a string
+            return None
+        return value, int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def keyset_paginate(queryset, sort: str = None, cursor: str = None,
+                    page_size: int = 24) -> tuple[list[tuple], str | None]:
+    """Gets and returns one page of product cards of ProductInventory
+       queryset and cursor of the next page (None if it is the last page).
+       Instead of OFFSET, it filters rows after the cursor (keyset
+       pagination), so LIMIT is pushed down to the database and only
+       the rows of the page are hydrated. 'sort' is one of KEYSET_SORTING."""
+    field, descending = KEYSET_SORTING.get(sort, KEYSET_SORTING['newest'])
+    if descending:
+        queryset = queryset.order_by(f'-{field}', '-id')
+        lookup = 'lt'
+    else:
+        queryset = queryset.order_by(field, 'id')
+        lookup = 'gt'
+
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        value, pk = position
+        try:
+            queryset = queryset.filter(Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'id__{lookup}': pk}))
+        except ValidationError:  # cursor value does not match the field - start from the first page
+            pass
+
+    # one row more than needed tells if there is the next page
+    products_data = get_product_cards(queryset[:page_size + 1])
+    next_cursor = None
+    if len(products_data) > page_size:
+        products_data = products_data[:page_size]
+        last = products_data[-1][0]
+        next_cursor = encode_cursor(getattr(last, field), last.id)
+
+    return products_data, next_cursor
 
 
 def generate_order_number(pk: int) -> str:
@@ -177,3 +522,15 @@ def send_notification(request, mail_subject, mail_template, context):
     mail = EmailMessage(mail_subject, message, from_email, to=to_email)
     mail.content_subtype = 'html'
     mail.send()
+
+
+def send_notification_on_commit(request, mail_subject, mail_template, context):
+    """Send email notification in a background thread after the current
+       transaction is committed (at once if there is no transaction)."""
+    def send():
+        try:
+            send_notification(request, mail_subject, mail_template, context)
+        finally:
+            connections.close_all()
+
+    transaction.on_commit(lambda: NOTIFICATION_EXECUTOR.submit(send))
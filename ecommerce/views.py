@@ -3,29 +3,44 @@
 import json
 import random
 
+from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.cache import cache
+from django.core.paginator import Paginator
 from django.urls import reverse_lazy
+from django.utils.functional import SimpleLazyObject, cached_property
 from elasticsearch_dsl import Q
 
-from django.shortcuts import get_object_or_404, render
-from django.http import HttpResponse
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404, render, redirect
+from django.http import HttpResponse, Http404
 from django.views import View
 from django.views.generic import ListView, TemplateView, RedirectView, FormView
 
 from accounts.models import UserProfile
+from .cart import get_cart_store
 from .forms import OrderForm
-from .models import Category, Product, ProductInventory, Stock, Media, Cart, OrderItem, Tax, Order, Payment, PlacedOrder
-from .utils import get_all_products_attribute_values, get_categories_with_parents_and_children, \
-    get_specific_attribute_values, get_filters, get_queryset_with_filters, generate_order_number, \
-    generate_transaction_id, send_notification
+from .orders import place_order, OutOfStockError
+from .taxes import get_cart_taxes
+from .models import Category, Product, ProductInventory, Stock, Media, Cart, OrderItem, Order, Payment, \
+    PlacedOrder, ProductAttributeValue, ProductRecommendation
+from .utils import get_categories_with_parents_and_children, \
+    get_specific_attribute_values, get_filters, generate_order_number, \
+    generate_transaction_id, send_notification_on_commit, get_product_cards, get_random_sample, get_cache_version, \
+    get_first_inventories, get_filtered_queryset, keyset_paginate, get_request_filters, sort_filters, \
+    get_indexed_attribute_values, get_specific_attribute_values_for_inventories, CATALOG_VERSION_KEY, \
+    RECOMMENDATIONS_VERSION_KEY
 
-from search.documents import ProductInventoryDocument
-from search.serializers import ProductInventorySearchSerializer
+from search.documents import ProductInventoryDocument, ATTRIBUTE_SEPARATOR
+from search.utils import execute_cached, normalize_query
 
 
 class MainShopPageView(TemplateView):
     """View for main page of the ecommerce app."""
     template_name = 'ecommerce/main_shop_page.html'
+    showcase_variants = 5
+    showcase_timeout = 60 * 60
+    on_sale_paginate_by = 12
 
     @staticmethod
     def get_products_data():
@@ -33,8 +48,7 @@ class MainShopPageView(TemplateView):
            of each of them and returns list which contains
            3 tuples - every one contains data for each of
            3 chosen categories."""
-        categories = Category.objects.filter(is_active=True)
-        random_categories = categories.order_by('?')[:3]
+        random_categories = get_random_sample(Category, 3, is_active=True)
 
         category1_items = []
         category2_items = []
@@ -42,17 +56,9 @@ class MainShopPageView(TemplateView):
         category_items = (category1_items, category2_items, category3_items)
 
         for i, category in enumerate(random_categories):
-            all_products = Product.objects.filter(category=category, is_active=True)
-            products = all_products.order_by('?')[:3]
-
-            for product in products:
-                product_inventory = ProductInventory.objects.filter(product=product)[0]
-                image = Media.objects.filter(product_inventory=product_inventory, is_feature=True)
-                if image:
-                    image = image[0]
-                units = get_object_or_404(Stock, product_inventory=product_inventory).units
-                attribute_values = get_all_products_attribute_values(product_inventory)
+            products = get_random_sample(Product, 3, category=category.id, is_active=True)
 
+            for product_inventory, units, image, attribute_values in get_product_cards(get_first_inventories(products)):
                 category_items[i].append((category, product_inventory, image, units, attribute_values))
 
         return [
@@ -61,43 +67,75 @@ class MainShopPageView(TemplateView):
             category3_items
         ]
 
-    @staticmethod
-    def get_products_on_sale():
-        """Gets and returns all active products that are currently on sale."""
-        product_inventories = ProductInventory.objects.filter(is_on_sale=True, is_active=True)
-        products_data = []
-        for product_inv in product_inventories:
-            image = Media.objects.filter(product_inventory=product_inv, is_feature=True)
-            if image:
-                image = image[0]
-            units = get_object_or_404(Stock, product_inventory=product_inv).units
-            attribute_values = get_all_products_attribute_values(product_inv)
-            data = (product_inv, image, units, attribute_values)
-            products_data.append(data)
-
-        return products_data
+    def get_products_on_sale(self, catalog_version, page_number):
+        """Gets and returns one page of active products that are currently
+           on sale - dict with products data and pagination details. Pages
+           are cached until the catalog changes."""
+        key = f'main_shop_on_sale:{catalog_version}:{page_number}'
+        on_sale = cache.get(key)
+        if on_sale is None:
+            # uses partial index productinventory_on_sale_idx
+            product_inventories = ProductInventory.objects.filter(
+                is_on_sale=True, is_active=True).order_by('-updated_at', 'id')
+            page = Paginator(product_inventories, self.on_sale_paginate_by).get_page(page_number)
+            on_sale = {
+                'products': [
+                    (product_inv, image, units, attribute_values)
+                    for product_inv, units, image, attribute_values in get_product_cards(page.object_list)
+                ],
+                'number': page.number,
+                'num_pages': page.paginator.num_pages,
+                'has_previous': page.has_previous(),
+                'has_next': page.has_next(),
+            }
+            cache.set(key, on_sale, timeout=self.showcase_timeout)
+        return on_sale
+
+    def get_showcase(self, catalog_version, variant):
+        """Gets and returns data of one of showcase_variants precomputed
+           showcases (see get_products_data). Showcases are cached until
+           the catalog changes."""
+        key = f'main_shop_showcase:{catalog_version}:{variant}'
+        showcase = cache.get(key)
+        if showcase is None:
+            showcase = self.get_products_data()
+            cache.set(key, showcase, timeout=self.showcase_timeout)
+        return showcase
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        data = self.get_products_data()
-        context['on_sale'] = self.get_products_on_sale()
+        catalog_version = get_cache_version(CATALOG_VERSION_KEY)
+        variant = random.randrange(self.showcase_variants)
+        # showcase is lazy - if its rendered fragment is cached, it is never fetched
+        context['showcase'] = SimpleLazyObject(lambda: self.get_showcase(catalog_version, variant))
+        context['showcase_version'] = catalog_version
+        context['showcase_variant'] = variant
+        context['showcase_timeout'] = self.showcase_timeout
+        sale_page = self.request.GET.get('sale_page', '1')
+        context['on_sale'] = self.get_products_on_sale(catalog_version, int(sale_page) if sale_page.isdigit() else 1)
         context['all_categories'] = get_categories_with_parents_and_children()
-        context['category1_items'] = data[0]
-        context['category2_items'] = data[1]
-        context['category3_items'] = data[2]
         return context
 
 
 class ProductsByCategoryView(ListView):
-    """View for fetching products by category (send in as "slug")."""
+    """View for fetching products by category (send in as "slug").
+       Products are paginated with keyset pagination - the next
+       page is pointed by 'cursor' GET parameter."""
     template_name = 'ecommerce/products_by_category.html'
     context_object_name = 'products_data'
     filter_presence = True
+    page_size = 24
+    next_cursor = None
 
     def get_queryset(self):
         slug = self.kwargs.get('slug')
         request_get = self.request.GET
-        return get_queryset_with_filters(request_get=request_get, slug=slug)
+        product_inventories = get_filtered_queryset(request_get=request_get, slug=slug)
+        products_data, self.next_cursor = keyset_paginate(product_inventories,
+                                                          sort=request_get.get('sort'),
+                                                          cursor=request_get.get('cursor'),
+                                                          page_size=self.page_size)
+        return products_data
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -113,69 +151,119 @@ class ProductsByCategoryView(ListView):
 
         context['filters'] = filters
 
+        # GET parameters without pagination and sorting, for building links
+        request_get = self.request.GET.copy()
+        request_get.pop('cursor', None)
+        sort = request_get.pop('sort', ['newest'])[-1]
+        context['sort'] = sort
+        context['filters_query'] = request_get.urlencode()
+        if self.next_cursor:
+            request_get['sort'] = sort
+            request_get['cursor'] = self.next_cursor
+            context['next_page_query'] = request_get.urlencode()
+
         return context
 
 
 class ProductDetailView(TemplateView):
     """View for handling pages with details about a product."""
     template_name = 'ecommerce/product_details.html'
+    snapshot_timeout = 60 * 60
+    # number of recommended products kept in the snapshot, three of them are displayed
+    recommendations_pool_size = 12
 
-    # If True that means that there are attribute values to choose from
-    is_to_choose = False
-
-    def get_products_data(self):
-        """Method gets and returns product details for a specific
-           product (based on 'slug' value in kwargs)."""
+    @staticmethod
+    def get_product(slug):
+        """Gets and returns product (based on 'slug') with prefetched
+           inventories (as 'inventories'), their stock, attribute
+           values and images, and product categories."""
+        product_inventories = ProductInventory.objects.select_related('product_inventory').prefetch_related(
+            Prefetch('attribute_values', queryset=ProductAttributeValue.objects.select_related('product_attribute')),
+            'media_product_inventory').order_by('id')
+        products = Product.objects.prefetch_related(
+            Prefetch('product', queryset=product_inventories, to_attr='inventories'), 'category')
+        return get_object_or_404(products, slug=slug)
+
+    def get_products_data(self, product):
+        """Method gets and returns product details for every
+           ProductInventory of the product - list of tuples
+           (product_inventory, attribute_values, units)."""
         products_data = []
-        slug = self.kwargs.get('slug')
-        product = get_object_or_404(Product, slug=slug)
-        product_inventories = ProductInventory.objects.filter(product=product)
-
-        def get_data(product_inv):
-            units = get_object_or_404(Stock, product_inventory=product_inv).units
-            attr_values = get_specific_attribute_values(product_inv)
-            if 'size' in attr_values or 'language' in attr_values:
-                self.is_to_choose = True
-            return product_inventory, attr_values, units
-
-        for product_inventory in product_inventories:
-            data = get_data(product_inventory)
-            products_data.append(data)
-
+        for product_inventory in product.inventories:
+            try:
+                units = product_inventory.product_inventory.units
+            except Stock.DoesNotExist:
+                units = 0
+            attr_values = {value.product_attribute.name: value.attribute_value
+                           for value in product_inventory.attribute_values.all()}
+            products_data.append((product_inventory, attr_values, units))
         return products_data
 
-    def get_three_products(self):
-        """Return three ProductInventory objects to display
-           in 'You might also like' section of the page."""
+    @cached_property
+    def snapshot(self):
+        """Everything needed to display the product, fetched once per
+           request. It is cached until the product changes (its updated_at)
+           or recommendations are refreshed, so views of the same product
+           cost one indexed query."""
         slug = self.kwargs.get('slug')
-        product = get_object_or_404(Product, slug=slug)
-        category = product.category.all().order_by('?')[0]
-        products = Product.objects.filter(category=category)
-        three_products = products.order_by('?')[:3]
-        products_data = []
-        for product in three_products:
-            product_inventory = ProductInventory.objects.filter(product=product)[0]
-            image = Media.objects.filter(product_inventory=product_inventory, is_feature=True)
-            if image:
-                image = image[0]
-            attribute_values = get_all_products_attribute_values(product_inventory)
-            units = get_object_or_404(Stock, product_inventory=product_inventory).units
-            data = (product, image, units, attribute_values)
-            products_data.append(data)
-        return products_data
+        updated_at = Product.objects.filter(slug=slug).values_list('updated_at', flat=True).first()
+        key = f'product_detail:{slug}:{updated_at and updated_at.timestamp()}:' \
+              f'{get_cache_version(RECOMMENDATIONS_VERSION_KEY)}'
+        snapshot = cache.get(key)
+        if snapshot is None:
+            product = self.get_product(slug)
+            products_data = self.get_products_data(product)
+            snapshot = {
+                'product': product,
+                'products_data': products_data,
+                'images': list(products_data[0][0].media_product_inventory.all()) if products_data else [],
+                # if True that means that there are attribute values to choose from
+                'is_to_choose': any('size' in attr_values or 'language' in attr_values
+                                    for product_inventory, attr_values, units in products_data),
+                'recommendation_cards': self.get_recommendation_cards(product),
+            }
+            cache.set(key, snapshot, timeout=self.snapshot_timeout)
+        return snapshot
+
+    def get_recommendation_cards(self, product):
+        """Returns cards (product, image, units, attribute_values) of products
+           for 'You might also like' section of the page - chosen from
+           recommendations precomputed by refresh_recommendations command.
+           If there are none yet, random products from one of the product's
+           categories are used."""
+        recommended_ids = list(ProductRecommendation.objects.filter(product=product).order_by(
+            '-score').values_list('recommended_product_id', flat=True)[:self.recommendations_pool_size])
+        if recommended_ids:
+            products = recommended_ids
+        else:
+            categories = list(product.category.all())
+            products = get_random_sample(
+                Product, self.recommendations_pool_size, category=random.choice(categories).id, is_active=True
+            ) if categories else []
+        if not products:
+            return []
+        return [
+            (product_inventory.product, image, units, attribute_values)
+            for product_inventory, units, image, attribute_values
+            in get_product_cards(get_first_inventories(products))
+        ]
+
+    def get_three_products(self):
+        """Return three products to display in 'You might also like' section,
+           sampled from recommendation cards kept in the snapshot."""
+        cards = self.snapshot['recommendation_cards']
+        return random.sample(cards, min(len(cards), 3))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         slug = self.kwargs.get('slug')
         title = slug.replace('-', ' ')
-        products_data = self.get_products_data()
-        images = Media.objects.filter(product_inventory=products_data[0][0])
 
-        context['is_to_choose'] = self.is_to_choose
+        context['is_to_choose'] = self.snapshot['is_to_choose']
         context['title'] = title
-        context['products_data'] = products_data
-        context['images'] = images
-        context['product'] = get_object_or_404(Product, slug=slug)
+        context['products_data'] = self.snapshot['products_data']
+        context['images'] = self.snapshot['images']
+        context['product'] = self.snapshot['product']
         context['three_products'] = self.get_three_products()
         return context
 
@@ -183,89 +271,140 @@ class ProductDetailView(TemplateView):
 class SearchProductInventoryView(View):
     """View for handling searching for products. It gets data
        from request.GET and returns data with help of elasticsearch
-       and other features from search app."""
-    productinventory_serializer = ProductInventorySearchSerializer
+       and other features from search app. Filtering, facet counts
+       and pagination are done by elasticsearch in one request."""
     search_document = ProductInventoryDocument
+    paginate_by = 30
+    facets_size = 500
+
+    def get_search(self, query, filters, page):
+        """Returns search with full text query, attribute filters, facet counts
+           (aggregation of 'attributes') and pagination. Filters are post filters,
+           so facet counts are computed for all results of the query."""
+        q = Q(
+            'multi_match',
+            query=query,
+            fields=['product.name', 'product_type', 'product.web_id', 'brand.name'],
+            fuzziness='auto',
+        ) & Q(
+            should=[
+                Q('match'),
+            ],
+            minimum_should_match=1,
+        )
+
+        search = self.search_document.search().query(q)
+        for attr_name, attr_values in filters.items():
+            search = search.post_filter(
+                'terms', attributes=[f'{attr_name}{ATTRIBUTE_SEPARATOR}{value}' for value in attr_values])
+        search.aggs.bucket('attributes', 'terms', field='attributes', size=self.facets_size)
+
+        start = (page - 1) * self.paginate_by
+        return search.extra(track_total_hits=True)[start:start + self.paginate_by]
 
     @staticmethod
-    def get_products_from_serializer_data(serializer_data):
-        json_data = json.dumps(serializer_data)
-        dict_data = json.loads(json_data)
-        all_products = []
+    def get_filters_from_aggregations(results):
+        """Returns filters with counts (like get_filters) from facet counts."""
+        counts = {}
+        for bucket in results.aggregations['attributes']['buckets']:
+            attr_name, attr_value = bucket['key'].split(ATTRIBUTE_SEPARATOR, 1)
+            counts.setdefault(attr_name, {})[attr_value] = bucket['doc_count']
+        return sort_filters(counts)
 
-        for data in dict_data:
-            data_id = data.get('id')
-            units = get_object_or_404(Stock, product_inventory__id=data_id).units
-            image = Media.objects.filter(product_inventory__id=data_id, is_feature=True)
-            if image:
-                image = image[0]
-            product_inventory = get_object_or_404(ProductInventory, id=data_id)
-            attr_values = get_all_products_attribute_values(product_inventory)
-            product_data = (product_inventory, units, image, attr_values)
-            all_products.append(product_data)
+    @staticmethod
+    def get_products_from_results(results):
+        """Returns product cards of search hits. They are built from fields
+           stored in the documents, only attribute values are fetched (in one
+           query). Hits indexed without data for displaying are loaded
+           from the database in one batch."""
+        hits = list(results)
+        cards = [hit.get_product_card() for hit in hits]
+        missing_ids = [int(hit.meta.id) for hit, card in zip(hits, cards) if card is None]
+        if missing_ids:
+            fallback = {product_data[0].id: product_data for product_data in get_product_cards(
+                ProductInventory.objects.filter(id__in=missing_ids))}
+        else:
+            fallback = {}
+
+        attribute_values = get_indexed_attribute_values(
+            {card[0].product_id for card in cards if card is not None})
+        all_products = []
+        for hit, card in zip(hits, cards):
+            if card is not None:
+                all_products.append((*card, attribute_values.get(card[0].product_id, {})))
+            elif int(hit.meta.id) in fallback:  # products deleted after indexing are skipped
+                all_products.append(fallback[int(hit.meta.id)])
         return all_products
 
     def get(self, request):
-        query = request.GET.get('query')
+        query = normalize_query(request.GET.get('query'))
+        page = request.GET.get('page', '1')
+        page = int(page) if page.isdigit() and int(page) > 0 else 1
+        # sorted, so the same filters in a different order share cached results
+        filters = {attr_name: sorted(attr_values)
+                   for attr_name, attr_values in sorted(get_request_filters(request.GET).items())}
         try:
-            q = Q(
-                'multi_match',
-                query=query,
-                fields=['product.name', 'product_type', 'product.web_id', 'brand.name'],
-                fuzziness='auto',
-            ) & Q(
-                should=[
-                    Q('match'),
-                ],
-                minimum_should_match=1,
-            )
-
-            search = self.search_document.search().query(q)
-            response = search.execute()
-
-            serializer = self.productinventory_serializer(response, many=True)
+            results = execute_cached(self.get_search(query, filters, page))
 
         except Exception as e:
             return HttpResponse(e, status=500)
 
         else:
-            all_products = self.get_products_from_serializer_data(serializer.data)
-            if len(self.request.GET) > 1:  # there is more than just query=...
-                names = []
-                for product in all_products:
-                    name = product[0]
-                    names.append(name)
-                prods_invs = ProductInventory.objects.filter(product__name__in=names)
-                all_products = get_queryset_with_filters(request_get=self.request.GET, products=prods_invs)
+            # GET parameters without page, for building pagination links
+            request_get = request.GET.copy()
+            request_get.pop('page', None)
             context = {
                 'all_categories': get_categories_with_parents_and_children(),
-                'filters': get_filters(),
-                'products_data': all_products
+                'filters': self.get_filters_from_aggregations(results),
+                'products_data': self.get_products_from_results(results),
+                'page': page,
+                'has_previous': page > 1,
+                'has_next': results.total > page * self.paginate_by,
+                'pagination_query': request_get.urlencode(),
             }
 
         return render(request, 'ecommerce/search.html', context)
 
 
+class FlushCartMixin:
+    """Writes cart kept in cart store (see ecommerce.cart) to the database before
+       handling request, for views that read Cart and OrderItem objects."""
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            get_cart_store(request).flush()
+        return super().dispatch(request, *args, **kwargs)
+
+
 class CartView(LoginRequiredMixin, TemplateView):
-    """Cart view, gets OrderItem objects and additional data
-       such us images and attribute values. If there is
-       no OrderItems is_empty is set to False."""
+    """Cart view, gets cart lines from cart store and additional data
+       such us images and attribute values. If there are
+       no cart lines is_empty is set to True."""
     template_name = 'ecommerce/cart.html'
 
     def get_cart_data(self) -> list[tuple[dict[str: any], dict[str: any], dict[str: any]]]:
-        """Method gets additional data for every OrderItem,
-           such as images (Media)."""
-        cart, created = Cart.objects.get_or_create(user=self.request.user)
-        cart_items = OrderItem.objects.filter(cart=cart)
+        """Method gets additional data for every cart line, such as
+           images (Media), with a constant number of queries. Cart items
+           are OrderItem objects that are not saved, only for displaying."""
+        lines = get_cart_store(self.request).get_lines()
+        ids = [line.product_inventory_id for line in lines]
+        product_inventories = ProductInventory.objects.select_related('product').prefetch_related(
+            Prefetch('media_product_inventory',
+                     queryset=Media.objects.filter(is_feature=True),
+                     to_attr='featured_images')).in_bulk(ids)
+        attribute_values = get_specific_attribute_values_for_inventories(ids)
+
         data = []
-        if cart_items:
-            for item in cart_items:
-                image = Media.objects.filter(product_inventory=item.product_inventory, is_feature=True)
-                attribute_values = get_specific_attribute_values(item.product_inventory)
-                if image:
-                    image = image[0]
-                d = ({'cart_item': item}, {'image': image}, {'attribute_values': attribute_values})
-                data.append(d)
+        for line in lines:
+            product_inventory = product_inventories.get(line.product_inventory_id)
+            if product_inventory is None:  # deleted after it was added to the cart
+                continue
+            item = OrderItem(product_inventory=product_inventory, quantity=line.quantity,
+                             price=line.price, amount=line.amount)
+            image = product_inventory.featured_images[0] if product_inventory.featured_images else None
+            d = ({'cart_item': item}, {'image': image},
+                 {'attribute_values': attribute_values.get(product_inventory.id, {})})
+            data.append(d)
         return data
 
     def get_context_data(self, **kwargs):
@@ -273,76 +412,17 @@ class CartView(LoginRequiredMixin, TemplateView):
         cart_items = self.get_cart_data()
         context['is_empty'] = len(cart_items) == 0
         context['cart_items'] = cart_items
-        context['cart'] = get_object_or_404(Cart, user=self.request.user)
+        context['cart'] = get_cart_store(self.request).get_totals()
         return context
 
 
 class AddToCartView(LoginRequiredMixin, RedirectView):
-    """RedirectView that gets sku of choosem ProductInventory and then
-       1. Fetches Cart if it exists or creates one if it does not.
-       2. Fetches OrderItem (and increments values) or creates one.
-       3. Redirects to cart page."""
-
-    @staticmethod
-    def if_cart_not_created(product_inventory, user, cart):
-        try:
-            # if there is OrderItem, that means that user is adding the same
-            # item to the cart for the second, third... time
-            order_item = OrderItem.objects.get(cart=cart, product_inventory=product_inventory)
-            order_item.quantity += 1
-            order_item.amount += order_item.price
-            order_item.save()
-        except OrderItem.DoesNotExist:
-            if product_inventory.is_on_sale:
-                price = product_inventory.sale_price
-            else:
-                price = product_inventory.store_price
-
-            order_item = OrderItem.objects.create(
-                user=user,
-                cart=cart,
-                product_inventory=product_inventory,
-                price=price,
-                amount=price  # quantity is 1, so the price = amount
-            )
-            order_item.save()
-
-        cart.total_amount += order_item.price
-        cart.quantity += 1
-        cart.save()
-
-    @staticmethod
-    def if_cart_created(product_inventory, user, cart):
-        """Cart was just created -> there is no OrderItems."""
-        if product_inventory.is_on_sale:
-            price = product_inventory.sale_price
-        else:
-            price = product_inventory.store_price
-
-        order_item = OrderItem.objects.create(
-            user=user,
-            cart=cart,
-            product_inventory=product_inventory,
-            price=price,
-            amount=price  # quantity is 1, so the price = amount
-        )
-        order_item.save()
-        cart.total_amount += order_item.price
-        cart.quantity += 1
-        cart.save()
-
-    def get_or_create_cart_and_order_item(self):
-        sku = self.request.GET.get('sku')
-        product_inventory = get_object_or_404(ProductInventory, sku=sku)
-        user = self.request.user
-        cart, created = Cart.objects.get_or_create(user=user)
-        if created:
-            self.if_cart_created(product_inventory, user, cart)
-        else:
-            self.if_cart_not_created(product_inventory, user, cart)
+    """RedirectView that gets sku of chosen ProductInventory, adds it
+       to the cart (see ecommerce.cart) and redirects to cart page."""
 
     def get_redirect_url(self):
-        self.get_or_create_cart_and_order_item()
+        product_inventory = get_object_or_404(ProductInventory, sku=self.request.GET.get('sku'))
+        get_cart_store(self.request).add(product_inventory)
         return reverse_lazy('cart')
 
 
@@ -351,17 +431,11 @@ class DeleteOrderItemView(RedirectView):
        and updates other cart values."""
 
     def delete_order_item(self):
-        """Method fetches (sku) OrderItem and removes it from user's cart."""
-        sku = self.kwargs.get('sku')
-        to_delete_item = get_object_or_404(OrderItem,
-                                           product_inventory__sku=sku,
-                                           user=self.request.user)
-        cart = to_delete_item.cart
-        # update cart
-        cart.quantity -= to_delete_item.quantity
-        cart.total_amount -= to_delete_item.amount
-        cart.save()
-        to_delete_item.delete()
+        """Method removes OrderItem (by sku) from user's cart."""
+        try:
+            get_cart_store(self.request).remove(self.kwargs.get('sku'))
+        except OrderItem.DoesNotExist:
+            raise Http404('No OrderItem matches the given query.')
 
     def get_redirect_url(self, **kwargs):
         self.delete_order_item()
@@ -373,60 +447,32 @@ class DeleteCartView(RedirectView):
 
     def delete_cart_items(self):
         """Delete all OrderItem objects from Cart."""
-        OrderItem.objects.filter(cart__user=self.request.user).delete()
-        cart = get_object_or_404(Cart, user=self.request.user)
-        cart.quantity = 0
-        cart.total_amount = 0
-        cart.total_tax_amount = 0
-        cart.save()
+        get_cart_store(self.request).clear()
 
     def get_redirect_url(self):
         self.delete_cart_items()
         return reverse_lazy('cart')
 
 
-class OrderConfirmationView(LoginRequiredMixin, TemplateView):
+class OrderConfirmationView(LoginRequiredMixin, FlushCartMixin, TemplateView):
     """View handles order confirmation."""
     template_name = 'ecommerce/order_summary.html'
 
-    def get_data(self):
-        cart = get_object_or_404(Cart, user=self.request.user)
-        order_items = OrderItem.objects.filter(cart=cart)
-        tax_data = []
-        for item in order_items:
-            taxes = Tax.objects.filter(product_type=item.product_inventory.product_type)
-            attribute_values = get_specific_attribute_values(item.product_inventory)
-            for tax in taxes:
-                amount = item.amount * tax.tax_percentage / 100
-                data = (item, tax, amount, attribute_values)
-                tax_data.append(data)
-
-        return tax_data
-
-    def get_total_amount_with_taxes(self):
-        """Returns a tuple of total amount and total tax amount."""
-        data = self.get_data()
-        total_tax_amount = 0
-        for item, tax, amount, attribute_values in data:
-            total_tax_amount += amount
-
-        cart = get_object_or_404(Cart, user=self.request.user)
-        total_cart_amount = cart.total_amount
-        cart.total_tax_amount = total_tax_amount
-        cart.save()
-
-        return total_cart_amount, total_tax_amount
-
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        tax_data = self.get_data()
-        total_cart_amount, total_tax_amount = self.get_total_amount_with_taxes()
-        context['tax_data'] = tax_data
-        context['total_amount'] = total_cart_amount + total_tax_amount
+        cart = get_object_or_404(Cart, user=self.request.user)
+        taxes = get_cart_taxes(self.request.user)
+        attribute_values = get_specific_attribute_values_for_inventories(
+            {line.item.product_inventory_id for line in taxes.lines})
+        context['tax_data'] = [
+            (line.item, line.tax, line.amount, attribute_values.get(line.item.product_inventory_id, {}))
+            for line in taxes.lines
+        ]
+        context['total_amount'] = cart.total_amount + taxes.total
         return context
 
 
-class CheckOutView(LoginRequiredMixin, FormView):
+class CheckOutView(LoginRequiredMixin, FlushCartMixin, FormView):
     """View for placing an order."""
     template_name = 'ecommerce/checkout.html'
     success_url = reverse_lazy('payment')
@@ -445,6 +491,7 @@ class CheckOutView(LoginRequiredMixin, FormView):
 
     def form_valid(self, form):
         cart = get_object_or_404(Cart, user=self.request.user)
+        total_tax_amount = get_cart_taxes(self.request.user).total
         order = Order()
         order.first_name = form.cleaned_data['first_name']
         order.last_name = form.cleaned_data['last_name']
@@ -456,8 +503,8 @@ class CheckOutView(LoginRequiredMixin, FormView):
         order.city = form.cleaned_data['city']
         order.pin_code = form.cleaned_data['pin_code']
         order.user = self.request.user
-        order.total = cart.total_amount + cart.total_tax_amount
-        order.total_tax = cart.total_tax_amount
+        order.total = cart.total_amount + total_tax_amount
+        order.total_tax = total_tax_amount
         order.payment_method = self.request.POST['payment-method']
         order.order_number = generate_order_number(self.request.user.id)
         order.save()
@@ -489,56 +536,13 @@ class PaymentView(LoginRequiredMixin, View):
         return render(request, self.template_name)
 
 
-class OrderPlacedView(LoginRequiredMixin, View):
-    """View finished ordering page."""
+class OrderPlacedView(LoginRequiredMixin, FlushCartMixin, View):
+    """View finished ordering page. Order is placed (stock updated, PlacedOrder
+       created for storing history of purchases and cart cleared) in one
+       transaction, see ecommerce.orders."""
     template_name = 'ecommerce/order_placed.html'
 
-    def create_placed_order(self):
-        """Create PlaceOrder for storing history of purchases."""
-        cart = get_object_or_404(Cart, user=self.request.user)
-        total_amount = cart.total_amount + cart.total_tax_amount
-        order = Order.objects.filter(user=self.request.user).order_by('-created_at')[0]
-        order_items = OrderItem.objects.filter(cart=cart)
-        order_items_list = []
-        for item in order_items:
-            d = {
-                'product': str(item.product_inventory),
-                'sku': item.product_inventory.sku,
-                'quantity': item.quantity
-            }
-            order_items_list.append(d)
-        order_items_json = json.dumps(order_items_list, indent=4)
-
-        place_order = PlacedOrder.objects.create(
-            user=self.request.user,
-            order_items=order_items_json,
-            total_amount=total_amount,
-            order_number=order.order_number,
-            order_date=order.created_at
-        )
-        place_order.save()
-
-    def delete_cart_items(self):
-        """Delete OrderItems from Cart and update Cart values."""
-        OrderItem.objects.filter(cart__user=self.request.user).delete()
-        cart = get_object_or_404(Cart, user=self.request.user)
-        cart.quantity = 0
-        cart.total_amount = 0
-        cart.total_tax_amount = 0
-        cart.save()
-
-    def update_product_inventory_data(self):
-        """Update ProductInventory data. Decrease value of units
-           in stock of ProductInventory and increase units_sold."""
-        order_items = OrderItem.objects.filter(cart__user=self.request.user)
-        for item in order_items:
-            stock = get_object_or_404(Stock, product_inventory=item.product_inventory)
-            stock.units -= item.quantity
-            stock.units_sold += item.quantity
-            stock.save()
-
-    def send_notification_email(self):
-        order = Order.objects.filter(user=self.request.user).order_by('-created_at')[0]
+    def send_notification_email(self, order):
         mail_subject = 'Your order was placed successfully!'
         mail_template = 'ecommerce/emails/order_notification.html'
         context = {
@@ -546,13 +550,21 @@ class OrderPlacedView(LoginRequiredMixin, View):
             'order': order,
             'to_email': order.email,
         }
-        send_notification(self.request, mail_subject, mail_template, context)
+        send_notification_on_commit(self.request, mail_subject, mail_template, context)
 
     def get(self, request, *args, **kwargs):
-        self.create_placed_order()
-        self.update_product_inventory_data()
-        self.delete_cart_items()
-        self.send_notification_email()
+        order = Order.objects.filter(user=request.user).order_by('-created_at').first()
+        if order is None:
+            raise Http404('There is no order to place.')
+        try:
+            placed_order = place_order(request.user, order)
+        except OutOfStockError as error:
+            messages.error(request, f'Sorry, some products are no longer available: {", ".join(error.skus)}.')
+            return redirect('cart')
+
+        get_cart_store(request).forget()
+        if placed_order is not None:
+            self.send_notification_email(order)
         return render(request, self.template_name)
 
 
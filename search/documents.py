@@ -1,20 +1,47 @@
 """For elasticsearch feature."""
+from decimal import Decimal
 
 from django_elasticsearch_dsl import Document, fields
 from django_elasticsearch_dsl.registries import registry
 
-from ecommerce.models import ProductInventory
+from ecommerce.models import ProductInventory, Product, Brand, ProductType, Stock, Media, Category, \
+    ProductAttribute, ProductAttributeValue, ProductAttributeValues
+
+# separates attribute name and attribute value in 'attributes' field
+ATTRIBUTE_SEPARATOR = ':'
+
+# prices are indexed as doubles
+PRICE_QUANTUM = Decimal('0.01')
 
 
 @registry.register_document
 class ProductInventoryDocument(Document):
     """Document for ProductInventory."""
     product = fields.ObjectField(
-        properties={'name': fields.TextField(), 'web_id': fields.TextField()}
+        properties={
+            'id': fields.IntegerField(),
+            'name': fields.TextField(),
+            'web_id': fields.TextField(),
+            # data for displaying search results
+            'slug': fields.KeywordField(index=False),
+            'description': fields.TextField(index=False),
+        }
     )
     brand = fields.ObjectField(properties={'name': fields.TextField()})
     product_type = fields.ObjectField(properties={'name': fields.TextField()})
 
+    # data for filtering and faceting
+    attributes = fields.KeywordField(multi=True)
+    categories = fields.KeywordField(multi=True)
+    units = fields.IntegerField()
+
+    # search-as-you-type suggestions (product name, brand name and web_id)
+    suggest = fields.CompletionField()
+
+    image = fields.ObjectField(
+        properties={'name': fields.KeywordField(index=False), 'alt_text': fields.TextField(index=False)}
+    )
+
     class Index:
         name = 'productinventory'
 
@@ -28,3 +55,80 @@ class ProductInventoryDocument(Document):
             'sale_price',
             'is_on_sale',
         ]
+
+        # models of indexed data, changing them updates related product inventories
+        related_models = [Product, Brand, ProductType, Stock, Media, Category,
+                          ProductAttribute, ProductAttributeValue, ProductAttributeValues]
+
+    def get_queryset(self):
+        return super().get_queryset().select_related(
+            'product', 'brand', 'product_type', 'product_inventory'
+        ).prefetch_related(
+            'attribute_values__product_attribute', 'product__category', 'media_product_inventory'
+        )
+
+    def get_instances_from_related(self, related_instance):
+        """Returns ProductInventory objects to update when a related object changes."""
+        if isinstance(related_instance, (Stock, Media)):
+            return related_instance.product_inventory
+        # reverse relations of ProductInventory foreign keys
+        elif isinstance(related_instance, Product):
+            return related_instance.product.all()
+        elif isinstance(related_instance, Brand):
+            return related_instance.brand.all()
+        elif isinstance(related_instance, ProductType):
+            return related_instance.product_type.all()
+        # 'attributes' and 'categories' fields
+        elif isinstance(related_instance, ProductAttributeValues):
+            return related_instance.productinventory
+        elif isinstance(related_instance, ProductAttributeValue):
+            return ProductInventory.objects.filter(attribute_values=related_instance)
+        elif isinstance(related_instance, ProductAttribute):
+            return ProductInventory.objects.filter(attribute_values__product_attribute=related_instance).distinct()
+        elif isinstance(related_instance, Category):
+            return ProductInventory.objects.filter(product__category=related_instance).distinct()
+
+    def prepare_attributes(self, instance):
+        """Attribute values as 'name:value' strings."""
+        return [f'{value.product_attribute.name}{ATTRIBUTE_SEPARATOR}{value.attribute_value}'
+                for value in instance.attribute_values.all()]
+
+    def prepare_categories(self, instance):
+        return [category.slug for category in instance.product.category.all()]
+
+    def prepare_units(self, instance):
+        try:
+            return instance.product_inventory.units
+        except Stock.DoesNotExist:
+            return 0
+
+    def prepare_suggest(self, instance):
+        return {'input': [instance.product.name, instance.brand.name, instance.product.web_id]}
+
+    def prepare_image(self, instance):
+        """File name and alt text of the featured image."""
+        images = [media for media in instance.media_product_inventory.all() if media.is_feature]
+        if images:
+            return {'name': images[0].image.name, 'alt_text': images[0].alt_text}
+        return None
+
+    def get_product_card(self):
+        """Returns (product_inventory, units, image) of a search hit, built
+           from stored fields without querying the database - ProductInventory,
+           Product and Media objects are not saved, they are only for displaying.
+           Returns None if the hit was indexed without data for displaying."""
+        if self.units is None or not self.product or self.product.slug is None:
+            return None
+
+        product = Product(id=self.product.id, name=self.product.name, slug=self.product.slug,
+                          description=self.product.description, web_id=self.product.web_id)
+        product_inventory = ProductInventory(
+            id=int(self.meta.id),
+            sku=self.sku,
+            product=product,
+            store_price=Decimal(str(self.store_price)).quantize(PRICE_QUANTUM),
+            sale_price=Decimal(str(self.sale_price)).quantize(PRICE_QUANTUM),
+            is_on_sale=self.is_on_sale,
+        )
+        image = Media(image=self.image.name, alt_text=self.image.alt_text) if self.image else None
+        return product_inventory, self.units, image
@@ -0,0 +1,325 @@
+"""In-process search engine used when elasticsearch is unavailable.
+
+It keeps prepared ProductInventoryDocument sources and an inverted index
+of the full text fields in memory and answers requests built with
+elasticsearch_dsl (search.to_dict()) - multi_match queries with fuzziness,
+terms post filters, terms aggregations, pagination and completion
+suggestions - returning elasticsearch_dsl Response, like search.execute().
+Its responses (LocalResponse) may be outdated, so they are not cached.
+"""
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.db import connections
+from elasticsearch_dsl.response import Response
+
+from ecommerce.utils import get_cache_version, CATALOG_VERSION_KEY
+from search.documents import ProductInventoryDocument
+
+# indexed full text fields - path in document source
+TEXT_FIELDS = ('product.name', 'product.web_id', 'brand.name', 'product_type.name')
+
+# BM25 parameters (elasticsearch defaults)
+K1 = 1.2
+B = 0.75
+# score of a term matched with one edit is multiplied by it (with two edits - squared)
+FUZZY_PENALTY = 0.5
+# the most edits fuzzy matching allows (like elasticsearch)
+MAX_EDITS = 2
+
+# minimum number of seconds between rebuilding the index after the catalog changed
+REBUILD_INTERVAL = 60
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text) -> list[str]:
+    return TOKEN_PATTERN.findall(str(text).lower()) if text is not None else []
+
+
+def get_path(source: dict, path: str):
+    """Gets value from nested source ('product.name' -> source['product']['name'])."""
+    for key in path.split('.'):
+        if not isinstance(source, dict):
+            return None
+        source = source.get(key)
+    return source
+
+
+def get_max_edits(term: str) -> int:
+    """Number of allowed edits for fuzziness 'auto'."""
+    if len(term) <= 2:
+        return 0
+    return 1 if len(term) <= 5 else 2
+
+
+def get_deletes(term: str, max_edits: int) -> set[str]:
+    """Returns variants of term with up to 'max_edits' characters deleted."""
+    deletes = {term}
+    variants = {term}
+    for _ in range(max_edits):
+        variants = {variant[:i] + variant[i + 1:] for variant in variants for i in range(len(variant))}
+        deletes |= variants
+    return deletes
+
+
+def edit_distance(first: str, second: str, max_distance: int) -> int:
+    """Levenshtein distance of two words, or max_distance + 1 if it is greater."""
+    if abs(len(first) - len(second)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (first_char != second_char)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+class LocalSearchIndex:
+    """Inverted index of documents - for every text field
+       {term: {document position: term frequency}}."""
+
+    def __init__(self, ids: list[str], sources: list[dict]):
+        self.ids = ids
+        self.sources = sources
+        self.postings = {field: defaultdict(dict) for field in TEXT_FIELDS}
+        self.lengths = {field: [0] * len(sources) for field in TEXT_FIELDS}
+        for position, source in enumerate(sources):
+            for field in TEXT_FIELDS:
+                terms = tokenize(get_path(source, field))
+                self.lengths[field][position] = len(terms)
+                for term, frequency in Counter(terms).items():
+                    self.postings[field][term][position] = frequency
+        self.average_lengths = {field: sum(lengths) / len(lengths) if lengths else 0
+                                for field, lengths in self.lengths.items()}
+
+        # terms of vocabulary by their variants with deleted characters, for finding fuzzy
+        # matches - terms within N edits share a variant with up to N deletes of both
+        self.deletes = defaultdict(set)
+        for field_postings in self.postings.values():
+            for term in field_postings:
+                for variant in get_deletes(term, MAX_EDITS if len(term) > 2 else 0):
+                    self.deletes[variant].add(term)
+
+    @classmethod
+    def build(cls):
+        document = ProductInventoryDocument()
+        ids, sources = [], []
+        for instance in document.get_queryset().iterator(chunk_size=2000):
+            if document.should_index_object(instance):
+                ids.append(str(instance.pk))
+                sources.append(document.prepare(instance))
+        return cls(ids, sources)
+
+    def expand(self, term: str, fuzziness) -> dict[str: float]:
+        """Returns terms from vocabulary matching 'term' with their weights."""
+        max_edits = get_max_edits(term) if str(fuzziness).lower() == 'auto' else min(int(fuzziness or 0), MAX_EDITS)
+        candidates = set()
+        for variant in get_deletes(term, max_edits):
+            candidates |= self.deletes.get(variant, set())
+        matches = {}
+        for candidate in candidates:
+            distance = edit_distance(term, candidate, max_edits)
+            if distance <= max_edits:
+                matches[candidate] = FUZZY_PENALTY ** distance
+        return matches
+
+    def score(self, text: str, fields: list[str], fuzziness) -> dict[int: float]:
+        """BM25 scores of documents matching any of terms of 'text' in any of
+           'fields'. Score of a document is its best field score (like
+           multi_match query of type best_fields)."""
+        # 'product_type' means all indexed fields of product_type object
+        fields = [indexed for indexed in TEXT_FIELDS
+                  if any(indexed == field or indexed.startswith(f'{field}.') for field in fields)] or TEXT_FIELDS
+        number_of_documents = len(self.sources)
+        expanded = [self.expand(term, fuzziness) for term in tokenize(text)]
+        scores = defaultdict(float)
+        for field in fields:
+            field_scores = defaultdict(float)
+            for matched_terms in expanded:
+                for matched_term, weight in matched_terms.items():
+                    postings = self.postings[field].get(matched_term)
+                    if not postings:
+                        continue
+                    idf = math.log(1 + (number_of_documents - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for position, frequency in postings.items():
+                        length_norm = 1 - B + B * self.lengths[field][position] / (self.average_lengths[field] or 1)
+                        field_scores[position] += weight * idf * frequency * (K1 + 1) / (frequency + K1 * length_norm)
+            for position, score in field_scores.items():
+                scores[position] = max(scores[position], score)
+        return scores
+
+    def matches_filter(self, position: int, terms_filters: list[tuple[str, set]]) -> bool:
+        """Values of one terms filter are alternatives, all filters must match."""
+        for field, values in terms_filters:
+            value = self.sources[position].get(field)
+            document_values = set(value) if isinstance(value, list) else {value}
+            if not document_values & values:
+                return False
+        return True
+
+    def aggregate(self, positions, aggs: dict) -> dict:
+        aggregations = {}
+        for name, agg in aggs.items():
+            terms = agg.get('terms')
+            if not terms:
+                continue
+            counts = Counter()
+            for position in positions:
+                value = get_path(self.sources[position], terms['field'])
+                counts.update(set(value) if isinstance(value, list) else {value} if value is not None else set())
+            buckets = sorted(counts.items(), key=lambda bucket: (-bucket[1], bucket[0]))[:terms.get('size', 10)]
+            aggregations[name] = {
+                'doc_count_error_upper_bound': 0,
+                'sum_other_doc_count': sum(counts.values()) - sum(count for _, count in buckets),
+                'buckets': [{'key': key, 'doc_count': count} for key, count in buckets],
+            }
+        return aggregations
+
+    def suggest(self, suggest: dict) -> dict:
+        """Completion suggestions - documents with an input starting with prefix."""
+        suggestions = {}
+        for name, options in suggest.items():
+            completion = options.get('completion', {})
+            # elasticsearch_dsl sends prefix of completion suggester as 'text'
+            prefix = (options.get('prefix') or options.get('text') or '').lower()
+            found, texts = [], set()
+            for position, source in enumerate(self.sources):
+                for text in (get_path(source, completion.get('field', 'suggest')) or {}).get('input', []):
+                    if text and str(text).lower().startswith(prefix):
+                        if completion.get('skip_duplicates') and text in texts:
+                            continue
+                        texts.add(text)
+                        found.append({'text': text, '_index': ProductInventoryDocument._index._name,
+                                      '_id': self.ids[position], '_score': 1.0, '_source': source})
+            found.sort(key=lambda option: option['text'])
+            suggestions[name] = [{'text': prefix, 'offset': 0, 'length': len(prefix),
+                                  'options': found[:completion.get('size', 5)]}]
+        return suggestions
+
+    def search(self, body: dict) -> dict:
+        """Returns raw response (like elasticsearch would) for request body."""
+        start = time.monotonic()
+        text_queries, filters = [], []
+        collect_clauses(body.get('query', {}), text_queries, filters)
+        post_filters = []
+        collect_clauses(body.get('post_filter', {}), [], post_filters)
+
+        if text_queries:
+            scores = defaultdict(float)
+            matching = None
+            for text, fields, fuzziness in text_queries:
+                query_scores = self.score(text, fields, fuzziness)
+                matching = set(query_scores) if matching is None else matching & set(query_scores)
+                for position, score in query_scores.items():
+                    scores[position] += score
+            scores = {position: scores[position] for position in matching}
+        else:
+            scores = {position: 1.0 for position in range(len(self.sources))}
+        positions = [position for position in scores if self.matches_filter(position, filters)]
+
+        aggregations = self.aggregate(positions, body.get('aggs', {}))
+        positions = [position for position in positions if self.matches_filter(position, post_filters)]
+        positions.sort(key=lambda position: (-scores[position], int(self.ids[position])))
+
+        offset, size = body.get('from', 0), body.get('size', 10)
+        hits = [{'_index': ProductInventoryDocument._index._name, '_id': self.ids[position],
+                 '_score': scores[position], '_source': self.sources[position]}
+                for position in positions[offset:offset + size]]
+        response = {
+            'took': int((time.monotonic() - start) * 1000),
+            'timed_out': False,
+            'hits': {'total': {'value': len(positions), 'relation': 'eq'},
+                     'max_score': hits[0]['_score'] if hits else None,
+                     'hits': hits},
+            'aggregations': aggregations,
+        }
+        if 'suggest' in body:
+            response['suggest'] = self.suggest(body['suggest'])
+        return response
+
+
+def collect_clauses(query: dict, text_queries: list, filters: list):
+    """Collects full text queries (text, fields, fuzziness) and terms filters
+       (field, values) from query. Like in elasticsearch, a full text query
+       with empty text matches no documents ('match' without any field
+       is skipped, it does not restrict results)."""
+    for clause_type, clause in query.items():
+        if clause_type == 'bool':
+            for occurrence in ('must', 'filter', 'should'):
+                clauses = clause.get(occurrence, [])
+                for sub_query in clauses if isinstance(clauses, list) else [clauses]:
+                    collect_clauses(sub_query, text_queries, filters)
+        elif clause_type == 'multi_match':
+            text_queries.append((clause.get('query') or '', clause.get('fields', []), clause.get('fuzziness')))
+        elif clause_type == 'match':
+            for field, options in clause.items():
+                options = options if isinstance(options, dict) else {'query': options}
+                text_queries.append((options.get('query') or '', [field], options.get('fuzziness')))
+        elif clause_type in ('terms', 'term'):
+            for field, values in clause.items():
+                filters.append((field, set(values) if isinstance(values, list) else {values}))
+
+
+_index = None
+_index_version = None
+_index_built_at = 0.0
+_index_lock = threading.Lock()
+_index_building = False
+# held while the first index is built, searches wait for it
+_first_build_lock = threading.Lock()
+
+
+class LocalResponse(Response):
+    """Response of the local index. It is not cached (in caches keyed by
+       catalog or search version), because the index can be outdated."""
+
+
+def set_local_index(version):
+    """Builds local index and replaces the current one."""
+    global _index, _index_version, _index_built_at
+    index = LocalSearchIndex.build()
+    with _index_lock:
+        _index, _index_version, _index_built_at = index, version, time.monotonic()
+
+
+def build_local_index(version):
+    """Rebuilds local index in a background thread."""
+    global _index_building
+    try:
+        set_local_index(version)
+    finally:
+        _index_building = False
+        connections.close_all()
+
+
+def get_local_index() -> LocalSearchIndex:
+    """Returns local index. The first one is built on first use (searches
+       wait for it), then it is rebuilt in a background thread (at most
+       every REBUILD_INTERVAL seconds) after the catalog changed - searches
+       meanwhile use the previous index, so they never wait for it."""
+    global _index_building
+    version = get_cache_version(CATALOG_VERSION_KEY)
+    if _index is None:
+        with _first_build_lock:
+            if _index is None:
+                set_local_index(version)
+    with _index_lock:
+        index = _index
+        outdated = version != _index_version and time.monotonic() - _index_built_at >= REBUILD_INTERVAL
+        if outdated and not _index_building:
+            _index_building = True
+            threading.Thread(target=build_local_index, args=(version,), name='local-search-index', daemon=True).start()
+    return index
+
+
+def execute_locally(search) -> LocalResponse:
+    """Executes elasticsearch_dsl search with local index."""
+    return LocalResponse(search, get_local_index().search(search.to_dict()))
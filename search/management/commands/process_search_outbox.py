@@ -0,0 +1,108 @@
+"""
+Django command to flush queued search index updates
+"""
+import datetime
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django_elasticsearch_dsl.registries import registry
+
+from search.models import SearchIndexOutbox
+from search.utils import bump_search_version
+
+
+# the longest wait (in seconds) before retrying a failed flush
+MAX_BACKOFF = 60.0
+
+
+class Command(BaseCommand):
+    """Django command (worker) that reads queued updates from SearchIndexOutbox,
+       coalesces duplicates and sends them to elasticsearch with bulk API.
+       Objects that no longer exist are deleted from index. It flushes
+       a batch as soon as there are 'batch-size' queued updates, otherwise
+       every 'interval' seconds. When flushing fails (e.g. elasticsearch
+       is down), updates stay queued and it is retried with backoff."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Maximum number of queued updates flushed at once.')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds between checking the queue, when it is not full.')
+        parser.add_argument('--once', action='store_true',
+                            help='Flush the queue and exit.')
+        parser.add_argument('--retention', type=float, default=24.0,
+                            help='Hours flushed updates are kept for reindex_products command to replay.')
+
+    @staticmethod
+    def index(model, pks):
+        """Index existing objects and delete the rest from index."""
+        pks = {model._meta.pk.to_python(pk) for pk in pks}
+        for doc in registry.get_documents([model]):
+            doc_instance = doc()
+            existing = list(doc_instance.get_queryset().filter(pk__in=pks))
+            if existing:
+                doc_instance.update(existing, refresh=False)
+
+            deleted = pks - {obj.pk for obj in existing}
+            if deleted:
+                doc_instance.update([model(pk=pk) for pk in deleted], refresh=False,
+                                    action='delete', raise_on_error=False)
+
+    def flush(self, batch_size) -> int:
+        """Flushes up to 'batch_size' queued updates and returns their number.
+           Rows are locked (skipping rows locked by other workers) and marked
+           as processed only if indexing succeeded."""
+        with transaction.atomic():
+            outbox = list(SearchIndexOutbox.objects.filter(processed_at__isnull=True).select_for_update(
+                skip_locked=True).order_by('id')[:batch_size])
+            if not outbox:
+                return 0
+
+            pks = defaultdict(set)
+            for row in outbox:
+                pks[row.model].add(row.object_pk)
+            for model, model_pks in pks.items():
+                self.index(apps.get_model(model), model_pks)
+
+            SearchIndexOutbox.objects.filter(id__in=[row.id for row in outbox]).update(processed_at=timezone.now())
+
+        bump_search_version()
+
+        self.stdout.write(f'{len(outbox)} queued updates flushed '
+                          f'({sum(len(model_pks) for model_pks in pks.values())} objects).')
+        return len(outbox)
+
+    @staticmethod
+    def delete_processed(retention: float):
+        """Deletes updates flushed more than 'retention' hours ago."""
+        SearchIndexOutbox.objects.filter(
+            processed_at__lt=timezone.now() - datetime.timedelta(hours=retention)).delete()
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        failures = 0
+        while True:
+            try:
+                flushed = self.flush(options['batch_size'])
+                if flushed < options['batch_size']:
+                    self.delete_processed(options['retention'])
+            except Exception as e:
+                if options['once']:
+                    raise
+                close_old_connections()  # the database connection may be broken
+                failures += 1
+                backoff = min(MAX_BACKOFF, options['interval'] * 2 ** failures)
+                self.stderr.write(self.style.ERROR(
+                    f'Flushing queued updates failed ({e.__class__.__name__}: {e}), retrying in {backoff:.0f} s.'))
+                time.sleep(backoff)
+                continue
+
+            failures = 0
+            if flushed < options['batch_size']:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,142 @@
+"""
+Django command to rebuild the products search index without a search outage
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils import timezone
+from elasticsearch.helpers import bulk, parallel_bulk
+
+from search.documents import ProductInventoryDocument
+from search.models import SearchIndexOutbox
+from search.utils import bump_search_version
+
+
+class Command(BaseCommand):
+    """Django command to index all ProductInventory objects into a new
+       versioned index (in parallel, chunk by chunk) and atomically point
+       the alias used by ProductInventoryDocument to it. Searches keep
+       using the old index until the new one is complete. Changes made
+       meanwhile (indexed through the alias into the old index by
+       process_search_outbox command) are replayed into the new index."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Number of threads sending bulk requests.')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of documents fetched from the database and sent in one bulk request.')
+        parser.add_argument('--keep-old', action='store_true',
+                            help='Do not delete indices the alias pointed to before.')
+
+    @staticmethod
+    def get_chunks(queryset, chunk_size):
+        """Yields lists of objects ordered by primary key. Every chunk is
+           fetched with its own query (so related objects are prefetched
+           per chunk), using the last primary key instead of an offset."""
+        last_pk = 0
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last_pk = chunk[-1].pk
+
+    def get_actions(self, document, index_name, chunk_size):
+        queryset = document.get_queryset()
+        for chunk in self.get_chunks(queryset, chunk_size):
+            for product_inventory in chunk:
+                if document.should_index_object(product_inventory):
+                    yield {**document._prepare_action(product_inventory, 'index'), '_index': index_name}
+
+    @staticmethod
+    def replay(document, connection, index_name, since_id) -> int:
+        """Indexes into the new index objects with updates queued in
+           SearchIndexOutbox after the row with id 'since_id' (flushed or not)
+           and returns their number. Objects that no longer exist are deleted."""
+        pks = {int(pk) for pk in SearchIndexOutbox.objects.filter(
+            id__gt=since_id, model=document.django.model._meta.label_lower).values_list('object_pk', flat=True)}
+        if not pks:
+            return 0
+
+        existing = [instance for instance in document.get_queryset().filter(pk__in=pks)
+                    if document.should_index_object(instance)]
+        bulk(connection, [{**document._prepare_action(instance, 'index'), '_index': index_name}
+                          for instance in existing])
+        # deleting a document that is not in the index is not an error
+        bulk(connection, [{'_op_type': 'delete', '_index': index_name, '_id': pk}
+                          for pk in pks - {instance.pk for instance in existing}], raise_on_error=False)
+        connection.indices.refresh(index=index_name)
+        return len(pks)
+
+    def swap_alias(self, connection, alias, index_name):
+        """Points alias to the new index in one atomic request and returns
+           names of indices it pointed to before. An old index that has
+           the same name as the alias (created by search_index command)
+           is deleted in the same request."""
+        actions = [{'add': {'index': index_name, 'alias': alias}}]
+        if connection.indices.exists_alias(name=alias):
+            old_indices = list(connection.indices.get_alias(name=alias))
+            actions = [{'remove': {'index': old_index, 'alias': alias}} for old_index in old_indices] + actions
+        elif connection.indices.exists(index=alias):
+            old_indices = []
+            actions = [{'remove_index': {'index': alias}}] + actions
+        else:
+            old_indices = []
+
+        connection.indices.update_aliases(body={'actions': actions})
+        return old_indices
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        document = ProductInventoryDocument()
+        connection = document._get_connection()
+        alias = document._index._name
+        index_name = f'{alias}-{timezone.now():%Y%m%d%H%M%S}'
+
+        # replicas and refreshing are not needed until the index is used
+        index = document._index.clone(name=index_name)
+        index.settings(number_of_replicas=0, refresh_interval='-1')
+        index.create(using=connection)
+        self.stdout.write(f'Created index {index_name}.')
+
+        # updates queued after it are replayed into the new index
+        last_outbox_id = SearchIndexOutbox.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+
+        total = document.get_queryset().count()
+        indexed = 0
+        start = time.monotonic()
+        try:
+            for success, info in parallel_bulk(
+                    connection,
+                    self.get_actions(document, index_name, options['chunk_size']),
+                    thread_count=options['threads'],
+                    chunk_size=options['chunk_size'],
+            ):
+                indexed += 1
+                if indexed % options['chunk_size'] == 0 or indexed == total:
+                    elapsed = time.monotonic() - start
+                    self.stdout.write(f'{indexed}/{total} indexed ({indexed / elapsed:.0f} documents/s).')
+        except Exception as e:
+            connection.indices.delete(index=index_name)
+            raise CommandError(f'Indexing failed, index {index_name} was deleted: {e}')
+
+        # back to default settings
+        connection.indices.put_settings(
+            index=index_name, body={'index': {'number_of_replicas': None, 'refresh_interval': None}})
+        connection.indices.refresh(index=index_name)
+
+        replayed = self.replay(document, connection, index_name, last_outbox_id)
+        self.stdout.write(f'{replayed} objects changed during indexing were indexed again.')
+
+        old_indices = self.swap_alias(connection, alias, index_name)
+        # changes flushed into the old index between replaying and swapping the alias
+        self.replay(document, connection, index_name, last_outbox_id)
+        bump_search_version()
+        self.stdout.write(f'Alias {alias} points to {index_name}.')
+        if old_indices and not options['keep_old']:
+            connection.indices.delete(index=','.join(old_indices))
+            self.stdout.write(f'Deleted old indices: {", ".join(old_indices)}.')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{indexed} documents indexed in {time.monotonic() - start:.1f} s.'))
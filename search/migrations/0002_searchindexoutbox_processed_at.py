@@ -0,0 +1,26 @@
+# Generated by Django 4.1.1 on 2026-10-18 15:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchindexoutbox',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='searchindexoutbox',
+            index=models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='search_outbox_queued_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchindexoutbox',
+            index=models.Index(fields=['processed_at'], name='search_outbox_processed_idx'),
+        ),
+    ]
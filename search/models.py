@@ -1,3 +1,26 @@
 from django.db import models
 
-# Create your models here.
+
+class SearchIndexOutbox(models.Model):
+    """Queued search index updates - model and primary key of objects
+       that have to be indexed again (or deleted from index, if they
+       no longer exist). Rows are added by OutboxSignalProcessor
+       (search.signals) in the same transaction as the change and
+       flushed by process_search_outbox command. Flushed rows are kept
+       for a while (with 'processed_at' set), so reindex_products command
+       can replay changes made while it was building a new index."""
+    model = models.CharField(max_length=100)  # app_label.model_name
+    object_pk = models.CharField(max_length=64)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True),
+                         name='search_outbox_queued_idx'),
+            models.Index(fields=['processed_at'], name='search_outbox_processed_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.model} | {self.object_pk}'
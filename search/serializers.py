@@ -99,3 +99,44 @@ class ProductInventorySearchSerializer(serializers.ModelSerializer):
             'product',
             'brand',
         ]
+
+
+# ================ READ-ONLY SERIALIZATION ================
+# Plain functions building the same data as serializers above, without fields
+# introspection. Related objects have to be fetched beforehand (see
+# get_product_inventory_queryset in search.views).
+
+def serialize_category(category: dict) -> dict:
+    """Takes category values ('name', 'slug', 'is_active')."""
+    return {'name': category['name'], 'slug': category['slug'], 'is_active': category['is_active']}
+
+
+def serialize_product(product) -> dict:
+    return {'name': product.name, 'web_id': product.web_id}
+
+
+def serialize_product_inventory(product_inventory) -> dict:
+    return {
+        'id': product_inventory.id,
+        'sku': product_inventory.sku,
+        'store_price': str(product_inventory.store_price),
+        'sale_price': str(product_inventory.sale_price),
+        'brand': {'name': product_inventory.brand.name},
+        'product': serialize_product(product_inventory.product),
+        'is_on_sale': product_inventory.is_on_sale,
+        'weight': product_inventory.weight,
+        'media': [{'image': media.image.url, 'alt_text': media.alt_text}
+                  for media in product_inventory.media_product_inventory.all()],
+        'attributes': [
+            {
+                'product_attribute': {
+                    'id': value.product_attribute.id,
+                    'name': value.product_attribute.name,
+                    'description': value.product_attribute.description,
+                },
+                'attribute_value': value.attribute_value,
+            }
+            for value in product_inventory.attribute_values.all()
+        ],
+        'product_type': product_inventory.product_type_id,
+    }
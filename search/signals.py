@@ -0,0 +1,65 @@
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import models
+from django_elasticsearch_dsl.registries import registry
+from django_elasticsearch_dsl.signals import BaseSignalProcessor
+
+from .models import SearchIndexOutbox
+
+
+def get_pks(instances) -> list:
+    """Returns primary keys of a model instance, a queryset or an iterable
+       (everything get_instances_from_related of a document can return)."""
+    if instances is None:
+        return []
+    if isinstance(instances, models.Model):
+        return [instances.pk]
+    if isinstance(instances, models.QuerySet):
+        return list(instances.values_list('pk', flat=True))
+    return [instance.pk for instance in instances]
+
+
+class OutboxSignalProcessor(BaseSignalProcessor):
+    """Signal processor that does not talk to elasticsearch. It records
+       indexed objects affected by a change (the object itself and objects
+       of documents with related models) in SearchIndexOutbox, so saving
+       does not wait for the search cluster."""
+
+    def setup(self):
+        models.signals.post_save.connect(self.handle_save)
+        models.signals.post_delete.connect(self.handle_delete)
+        models.signals.m2m_changed.connect(self.handle_m2m_changed)
+        models.signals.pre_delete.connect(self.handle_pre_delete)
+
+    def teardown(self):
+        models.signals.post_save.disconnect(self.handle_save)
+        models.signals.post_delete.disconnect(self.handle_delete)
+        models.signals.m2m_changed.disconnect(self.handle_m2m_changed)
+        models.signals.pre_delete.disconnect(self.handle_pre_delete)
+
+    @staticmethod
+    def enqueue(model, pks):
+        SearchIndexOutbox.objects.bulk_create([
+            SearchIndexOutbox(model=model._meta.label_lower, object_pk=str(pk)) for pk in set(pks)
+        ])
+
+    def enqueue_related(self, instance):
+        for doc in registry._get_related_doc(instance):
+            try:
+                related = doc().get_instances_from_related(instance)
+            except ObjectDoesNotExist:
+                related = None
+            self.enqueue(doc.django.model, get_pks(related))
+
+    def handle_save(self, sender, instance, **kwargs):
+        if instance.__class__ in registry.get_models():
+            self.enqueue(instance.__class__, [instance.pk])
+        self.enqueue_related(instance)
+
+    def handle_pre_delete(self, sender, instance, **kwargs):
+        """Relations do not exist after deleting, so objects of
+           related documents are queued before."""
+        self.enqueue_related(instance)
+
+    def handle_delete(self, sender, instance, **kwargs):
+        if instance.__class__ in registry.get_models():
+            self.enqueue(instance.__class__, [instance.pk])
@@ -0,0 +1,87 @@
+"""Tests for management commands of search app."""
+import io
+import json
+
+import pytest
+from django.utils import timezone
+from elasticsearch.serializer import JSONSerializer
+
+from search.documents import ProductInventoryDocument
+from search.management.commands.process_search_outbox import Command as ProcessOutboxCommand
+from search.management.commands.reindex_products import Command as ReindexCommand
+from search.models import SearchIndexOutbox
+
+
+class RecordingConnection:
+    """Elasticsearch client that records actions of bulk requests."""
+
+    def __init__(self):
+        self.actions = []
+        self.indices = self
+        self.refreshed = []
+        self.transport = self
+        self.serializer = JSONSerializer()
+
+    def bulk(self, *args, body, **kwargs):
+        lines = [json.loads(line) for line in body.splitlines()]
+        items = []
+        while lines:
+            action = lines.pop(0)
+            op_type, meta = next(iter(action.items()))
+            if op_type != 'delete':
+                lines.pop(0)
+            self.actions.append((op_type, meta['_index'], meta['_id']))
+            items.append({op_type: {'status': 200}})
+        return {'errors': False, 'items': items}
+
+    def refresh(self, index):
+        self.refreshed.append(index)
+
+
+def test_reindex_replays_changes_made_during_indexing(db, product_inventory_factory):
+    """Test that objects changed after indexing started (queued in the outbox,
+       even if already flushed) are indexed again into the new index and
+       objects deleted meanwhile are deleted from it."""
+    product_inventory_factory.create()
+    last_outbox_id = SearchIndexOutbox.objects.order_by('-id').values_list('id', flat=True).first()
+    changed = product_inventory_factory.create()
+    SearchIndexOutbox.objects.update(processed_at=timezone.now())
+    SearchIndexOutbox.objects.create(model='ecommerce.productinventory', object_pk='999999')
+
+    connection = RecordingConnection()
+    replayed = ReindexCommand.replay(ProductInventoryDocument(), connection, 'new-index', last_outbox_id)
+
+    assert replayed == 2
+    assert sorted(connection.actions) == [('delete', 'new-index', 999999), ('index', 'new-index', changed.pk)]
+    assert connection.refreshed == ['new-index']
+
+
+class StopWorker(BaseException):
+    pass
+
+
+class FailingOutboxCommand(ProcessOutboxCommand):
+    """Worker whose flushes fail twice, then succeed, then it is stopped."""
+
+    def __init__(self):
+        super().__init__(stdout=io.StringIO(), stderr=io.StringIO())
+        self.results = [ConnectionError('search is down'), ConnectionError('search is down'), 0, StopWorker()]
+
+    def flush(self, batch_size):
+        result = self.results.pop(0)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def delete_processed(self, retention):
+        pass
+
+
+def test_outbox_worker_retries_failed_flushes(db):
+    """Test that a failed flush does not stop the worker."""
+    command = FailingOutboxCommand()
+    with pytest.raises(StopWorker):
+        command.handle(batch_size=10, interval=0.001, once=False, retention=1)
+
+    assert not command.results
+    assert command.stderr._out.getvalue().count('search is down') == 2
@@ -0,0 +1,82 @@
+"""Tests for local in-process search engine."""
+import threading
+import time
+
+from elasticsearch_dsl.response import Response
+
+from ecommerce.views import SearchProductInventoryView
+from search import local
+from search.local import LocalSearchIndex
+
+SOURCES = {
+    '1': {'product': {'name': 'Red t-shirt', 'web_id': '1001'}, 'brand': {'name': 'Nike'},
+          'attributes': ['color:red', 'size:m']},
+    '2': {'product': {'name': 'Blue t-shirt with long sleeves and a print', 'web_id': '1002'},
+          'brand': {'name': 'Adidas'}, 'attributes': ['color:blue', 'size:m']},
+    '3': {'product': {'name': 'Running shoes', 'web_id': '1003'}, 'brand': {'name': 'Nike'},
+          'attributes': ['color:red', 'size:42']},
+}
+
+
+def search(query, filters=None, page=1):
+    index = LocalSearchIndex(list(SOURCES), list(SOURCES.values()))
+    es_search = SearchProductInventoryView().get_search(query, filters or {}, page)
+    return Response(es_search, index.search(es_search.to_dict()))
+
+
+def test_local_search_ranking_and_fuzziness():
+    """Test that shorter matching fields rank higher and typos are tolerated."""
+    response = search('tshirt shirt')
+    assert [hit.meta.id for hit in response] == ['1', '2']
+
+    response = search('runing shoos')
+    assert [hit.meta.id for hit in response] == ['3']
+
+    assert [hit.meta.id for hit in search('nike')] == ['1', '3']
+
+
+def test_local_search_post_filters_and_aggregations():
+    """Test that facet counts ignore post filters and filters are
+       combined like in elasticsearch."""
+    response = search('nike', filters={'color': ['red'], 'size': ['m', 'l']})
+    assert [hit.meta.id for hit in response] == ['1']
+    assert response.hits.total.value == 1
+    assert {bucket.key: bucket.doc_count for bucket in response.aggregations.attributes.buckets} == {
+        'color:red': 2, 'size:m': 1, 'size:42': 1}
+
+
+def test_local_search_empty_query_matches_nothing():
+    """Test that an empty query matches no documents, like in elasticsearch."""
+    assert [hit.meta.id for hit in search('')] == []
+    assert search('   ').hits.total.value == 0
+
+
+def test_local_index_is_built_on_first_use_and_rebuilt_in_background(monkeypatch):
+    """Test that the first search waits for the index and later searches
+       use the previous index while a new one is built."""
+    built = threading.Event()
+    first_index = LocalSearchIndex(list(SOURCES)[:1], list(SOURCES.values())[:1])
+    index = LocalSearchIndex(list(SOURCES), list(SOURCES.values()))
+    indexes = iter([first_index, index])
+
+    def build():
+        if local._index is not None:  # rebuilding
+            built.wait(5)
+        return next(indexes)
+
+    monkeypatch.setattr(LocalSearchIndex, 'build', staticmethod(build))
+    monkeypatch.setattr(local, '_index', None)
+    monkeypatch.setattr(local, '_index_version', None)
+    monkeypatch.setattr(local, 'REBUILD_INTERVAL', 0)
+    monkeypatch.setattr(local.connections, 'close_all', lambda: None)
+    monkeypatch.setattr(local, 'get_cache_version', lambda key: 1)
+    assert local.get_local_index() is first_index
+
+    monkeypatch.setattr(local, 'get_cache_version', lambda key: 2)
+    assert local.get_local_index() is first_index
+    built.set()
+    for _ in range(50):
+        if local.get_local_index() is index:
+            break
+        time.sleep(0.01)
+    assert local.get_local_index() is index
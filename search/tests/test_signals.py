@@ -0,0 +1,46 @@
+"""Tests for queueing search index updates."""
+
+from ecommerce.models import ProductAttributeValues
+from search.models import SearchIndexOutbox
+
+
+def get_queued(model):
+    return set(SearchIndexOutbox.objects.filter(model=model).values_list('object_pk', flat=True))
+
+
+def test_changes_are_queued_in_outbox(db, product_inventory_factory, stock_factory):
+    """Test that saving or deleting indexed objects (and their related
+       objects) queues updates instead of indexing them."""
+    product_inventory = product_inventory_factory.create()
+    assert get_queued('ecommerce.productinventory') == {str(product_inventory.pk)}
+
+    SearchIndexOutbox.objects.all().delete()
+    stock_factory.create(product_inventory=product_inventory)
+    assert get_queued('ecommerce.productinventory') == {str(product_inventory.pk)}
+
+    SearchIndexOutbox.objects.all().delete()
+    product_inventory.product.name = 'new name'
+    product_inventory.product.save()
+    assert get_queued('ecommerce.productinventory') == {str(product_inventory.pk)}
+    assert not get_queued('ecommerce.product')
+
+
+def test_attribute_and_category_changes_are_queued(
+        db, single_category, product_factory, product_inventory_factory, product_attribute_value_factory):
+    """Test that changes of data indexed in 'attributes' and 'categories'
+       queue updates of related product inventories."""
+    product_inventory = product_inventory_factory.create(product=product_factory.create(category=[single_category]))
+    attribute_value = product_attribute_value_factory.create()
+
+    SearchIndexOutbox.objects.all().delete()
+    link = ProductAttributeValues.objects.create(productinventory=product_inventory, attributevalues=attribute_value)
+    assert get_queued('ecommerce.productinventory') == {str(product_inventory.pk)}
+
+    for instance in (attribute_value, attribute_value.product_attribute, single_category):
+        SearchIndexOutbox.objects.all().delete()
+        instance.save()
+        assert get_queued('ecommerce.productinventory') == {str(product_inventory.pk)}
+
+    SearchIndexOutbox.objects.all().delete()
+    link.delete()
+    assert get_queued('ecommerce.productinventory') == {str(product_inventory.pk)}
@@ -0,0 +1,48 @@
+"""Tests for caching results of elasticsearch searches."""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from elasticsearch_dsl.response import Response
+
+from search.documents import ProductInventoryDocument
+from search.utils import execute_cached, bump_search_version
+
+
+class CountingSearch:
+    """Search that returns a fixed response and counts how many times it was executed."""
+
+    def __init__(self):
+        self.search = ProductInventoryDocument.search().query('match', **{'product.name': 't-shirt'})
+        self._doc_type = self.search._doc_type
+        self.executed = 0
+
+    def to_dict(self):
+        return self.search.to_dict()
+
+    def execute(self):
+        self.executed += 1
+        time.sleep(0.1)
+        return Response(self.search, {
+            'hits': {'total': {'value': 1}, 'hits': [{'_id': '1', '_source': {'sku': 'sku'}}]},
+            'aggregations': {},
+        })
+
+
+def test_execute_cached_executes_search_once():
+    """Test that concurrent and later requests share results of one
+       execution and that bumping search version invalidates them."""
+    cache.clear()
+    search = CountingSearch()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: execute_cached(search), range(4)))
+    assert search.executed == 1
+    assert [[hit.sku for hit in result] for result in results] == [['sku']] * 4
+
+    execute_cached(search)
+    assert search.executed == 1
+
+    bump_search_version()
+    execute_cached(search)
+    assert search.executed == 2
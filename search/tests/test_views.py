@@ -0,0 +1,160 @@
+"""Tests for search REST API."""
+import time
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from elasticsearch_dsl.response import Response
+
+from search import local, views
+from search.documents import ProductInventoryDocument
+from search.local import LocalSearchIndex, execute_locally
+from search.serializers import ProductInventorySerializer
+from search.utils import aexecute_cached, aexecute_search, execute_cached, get_search_cache_key
+from search.views import get_search_query, get_suggestions
+
+
+@pytest.fixture
+def local_search(settings, monkeypatch):
+    """Makes searches use local index (SEARCH_LOCAL_ONLY setting). Calling
+       the returned function builds the index from the database."""
+    settings.SEARCH_LOCAL_ONLY = True
+    cache.clear()
+
+    def build_index():
+        monkeypatch.setattr(local, '_index', LocalSearchIndex.build())
+        monkeypatch.setattr(local, '_index_built_at', time.monotonic())
+
+    return build_index
+
+
+@pytest.mark.parametrize('number_of_products', [1, 5])
+def test_product_inventory_by_web_id(
+        db, client, django_assert_num_queries, product_factory, product_inventory_factory,
+        media_factory, product_attribute_value_factory, number_of_products):
+    """Test that inventories are serialized like ProductInventorySerializer does, with
+       a constant number of queries, and that repeated requests get 304."""
+    product = product_factory.create(web_id='123456')
+    for _ in range(number_of_products):
+        product_inventory = product_inventory_factory.create(product=product)
+        media_factory.create(product_inventory=product_inventory)
+        product_inventory.attribute_values.add(product_attribute_value_factory.create())
+
+    # last modified, inventories with product and brand, images and attribute values
+    with django_assert_num_queries(4):
+        response = client.get('/api/inventory/123456/')
+    assert response.status_code == 200
+
+    data = response.json()
+    expected = ProductInventorySerializer(product.product.order_by('id'), many=True).data
+    assert [{key: value for key, value in item.items() if key != 'media'} for item in data] == \
+        [dict(item) for item in expected]
+    assert all(len(item['media']) == 1 for item in data)
+
+    response = client.get('/api/inventory/123456/', HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 304
+
+
+def test_product_inventory_etag_changes_with_brand(db, client, product_factory, product_inventory_factory):
+    """Test that renaming a brand of inventories changes ETag of the response."""
+    product_inventory = product_inventory_factory.create(product=product_factory.create(web_id='123456'))
+    response = client.get('/api/inventory/123456/')
+
+    product_inventory.brand.name = 'renamed brand'
+    product_inventory.brand.save()
+
+    response = client.get('/api/inventory/123456/', HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == 200
+    assert response.json()[0]['brand']['name'] == 'renamed brand'
+
+
+def test_autocomplete(db, client, local_search, monkeypatch, product_factory, product_inventory_factory):
+    """Test that suggestions are returned for normalized prefixes of at least
+       two characters, with capped size, and frequent prefixes are kept in memory."""
+    for name in ('Red shirt', 'Red shoes', 'Blue shirt'):
+        product_inventory_factory.create(product=product_factory.create(name=name, slug=name.lower().replace(' ', '-')))
+    local_search()
+    get_suggestions.cache_clear()
+    # responses like from elasticsearch (not LocalResponse), so they are cached
+    monkeypatch.setattr(views, 'execute_search', lambda search: Response(search, execute_locally(search).to_dict()))
+
+    response = client.get('/api/autocomplete/', {'q': 'r'})
+    assert response.json() == {'query': 'r', 'suggestions': []}
+    assert get_suggestions.cache_info().misses == 0
+
+    response = client.get('/api/autocomplete/', {'q': '  RED   s', 'size': '50'})
+    assert response['Cache-Control'] == 'public, max-age=60'
+    assert response.json() == {'query': 'red s', 'suggestions': [
+        {'text': 'Red shirt', 'name': 'Red shirt', 'slug': 'red-shirt'},
+        {'text': 'Red shoes', 'name': 'Red shoes', 'slug': 'red-shoes'},
+    ]}
+
+    response = client.get('/api/autocomplete/', {'q': 'red s', 'size': 'abc'})
+    assert len(response.json()['suggestions']) == 2
+    assert get_suggestions.cache_info().hits == 0
+    assert get_suggestions.cache_info().misses == 2
+
+    client.get('/api/autocomplete/', {'q': 'red s', 'size': '5'})
+    assert get_suggestions.cache_info().hits == 1
+
+
+def test_autocomplete_local_suggestions_are_not_cached(
+        db, client, local_search, product_factory, product_inventory_factory):
+    """Test that suggestions of the local index are not kept in memory
+       nor cached by clients."""
+    product_inventory_factory.create(product=product_factory.create(name='Red shirt', slug='red-shirt'))
+    local_search()
+    get_suggestions.cache_clear()
+
+    for _ in range(2):
+        response = client.get('/api/autocomplete/', {'q': 'red'})
+        assert [suggestion['slug'] for suggestion in response.json()['suggestions']] == ['red-shirt']
+        assert 'public' not in response.get('Cache-Control', '')
+    assert get_suggestions.cache_info().hits == 0
+    assert get_suggestions.cache_info().currsize == 0
+
+
+def test_async_category_list(db, client, category_factory):
+    """Test that async category list returns all categories like CategoryList does."""
+    category_factory.create(name='Shoes', slug='shoes')
+
+    response = client.get('/api/async/inventory/category/all/')
+    assert response.status_code == 200
+    assert response.json() == client.get('/api/inventory/category/all/').json()
+
+
+def test_async_search(db, client, local_search, product_factory, product_inventory_factory):
+    """Test that async search returns a page of search results and products
+       with SKU or web_id equal to the query."""
+    for name, web_id, sku in (('Red shirt', 'shirt', 'red-shirt'), ('Blue shirt', 'blue', 'blue-shirt'),
+                              ('Red shoes', 'red', 'shoes')):
+        product_inventory_factory.create(
+            product=product_factory.create(name=name, slug=sku, web_id=web_id), sku=sku)
+    local_search()
+
+    response = client.get('/api/async/search/shirt/', {'limit': '1'})
+    assert response.status_code == 200
+    data = response.json()
+    assert data['count'] == 2
+    assert len(data['results']) == 1
+    assert [item['sku'] for item in data['exact_matches']] == ['red-shirt']
+
+    data = client.get('/api/async/search/SHOES/').json()
+    assert [item['sku'] for item in data['exact_matches']] == ['shoes']
+
+
+def test_aexecute_cached_matches_execute_cached(db, local_search, product_factory, product_inventory_factory):
+    """Test that async search helpers return the same results as sync ones."""
+    product_inventory_factory.create(product=product_factory.create(name='Red shirt', slug='red-shirt'))
+    local_search()
+    search = ProductInventoryDocument.search().query(get_search_query('shirt'))
+
+    results = async_to_sync(aexecute_cached)(search)
+    assert results.total == 1
+    assert [hit.product.name for hit in results] == ['Red shirt']
+    # results of the local index are not cached
+    assert cache.get(get_search_cache_key(search)) is None
+
+    cache.clear()
+    assert [hit.meta.id for hit in async_to_sync(aexecute_search)(search)] == \
+        [hit.meta.id for hit in execute_cached(search)]
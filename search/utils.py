@@ -0,0 +1,165 @@
+"""Helpers for executing elasticsearch searches and caching their results."""
+import asyncio
+import hashlib
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.exceptions import ConnectionError
+from elasticsearch_dsl.response import Response
+
+from ecommerce.utils import get_cache_version, bump_cache_version, CATALOG_VERSION_KEY
+from search.local import execute_locally, LocalResponse
+
+# bumped after documents are indexed (process_search_outbox and reindex_products commands)
+SEARCH_VERSION_KEY = 'search_index_version'
+
+SEARCH_CACHE_TIMEOUT = 60
+# how long other requests wait for results of the same search, before executing it on their own
+SEARCH_LOCK_TIMEOUT = 5
+SEARCH_LOCK_POLL_INTERVAL = 0.02
+
+_async_client = None
+
+
+def normalize_query(query) -> str:
+    """Lowercase query with single spaces, so similar queries share cached results."""
+    return ' '.join((query or '').lower().split())
+
+
+def bump_search_version():
+    """Invalidates all cached search results."""
+    bump_cache_version(SEARCH_VERSION_KEY)
+
+
+def execute_search(search):
+    """Executes search with elasticsearch or, if it is unavailable (or
+       SEARCH_LOCAL_ONLY setting is set), with local in-process index."""
+    if settings.SEARCH_LOCAL_ONLY:
+        return execute_locally(search)
+    try:
+        return search.execute()
+    except ConnectionError:
+        return execute_locally(search)
+
+
+def get_async_client() -> AsyncElasticsearch:
+    """Returns elasticsearch client for async views. It is shared
+       by all requests, so they share its connection pool."""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncElasticsearch(**settings.ELASTICSEARCH_DSL['default'])
+    return _async_client
+
+
+async def aexecute_search(search):
+    """Async version of execute_search."""
+    if settings.SEARCH_LOCAL_ONLY:
+        return await sync_to_async(execute_locally)(search)
+    try:
+        response = await get_async_client().search(index=search._index, body=search.to_dict())
+    except ConnectionError:
+        return await sync_to_async(execute_locally)(search)
+    return Response(search, response)
+
+
+class SearchResults:
+    """Results of a search that can be cached - hits (their ids and sources),
+       total number of hits and aggregations. Iterating returns hits
+       as documents, like iterating elasticsearch response."""
+
+    def __init__(self, document, hits, total, aggregations):
+        self.document = document
+        self.hits = hits
+        self.total = total
+        self.aggregations = aggregations
+
+    @classmethod
+    def from_response(cls, document, response):
+        return cls(
+            document=document,
+            hits=[{'_id': hit.meta.id, '_source': hit.to_dict()} for hit in response],
+            total=response.hits.total.value,
+            aggregations=response.aggregations.to_dict(),
+        )
+
+    def __iter__(self):
+        return (self.document.from_es(hit) for hit in self.hits)
+
+    def __len__(self):
+        return len(self.hits)
+
+
+def get_search_cache_key(search) -> str:
+    """Key of cached results - versions and hash of the search request
+       (query, filters, aggregations and pagination)."""
+    body = json.dumps(search.to_dict(), sort_keys=True, default=str)
+    return (f'search:{get_cache_version(CATALOG_VERSION_KEY)}:{get_cache_version(SEARCH_VERSION_KEY)}:'
+            f'{hashlib.md5(body.encode()).hexdigest()}')
+
+
+def execute_cached(search) -> SearchResults:
+    """Executes search and returns its results, cached until indexed documents
+       or the catalog change (or SEARCH_CACHE_TIMEOUT passes) - results of
+       the local index are not cached. Only one request executes a search
+       that is not cached, concurrent requests for the same search wait
+       for its results instead of sending it again."""
+    key = get_search_cache_key(search)
+    results = cache.get(key)
+    if results is not None:
+        return results
+
+    document = search._doc_type[0]
+    lock_key = f'{key}:lock'
+    if not cache.add(lock_key, True, timeout=SEARCH_LOCK_TIMEOUT):
+        deadline = time.monotonic() + SEARCH_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(SEARCH_LOCK_POLL_INTERVAL)
+            results = cache.get(key)
+            if results is not None:
+                return results
+            if cache.get(lock_key) is None:  # the other request failed
+                break
+        return SearchResults.from_response(document, execute_search(search))
+
+    try:
+        response = execute_search(search)
+        results = SearchResults.from_response(document, response)
+        if not isinstance(response, LocalResponse):
+            cache.set(key, results, timeout=SEARCH_CACHE_TIMEOUT)
+    finally:
+        cache.delete(lock_key)
+    return results
+
+
+async def aexecute_cached(search) -> SearchResults:
+    """Async version of execute_cached."""
+    key = get_search_cache_key(search)
+    results = await cache.aget(key)
+    if results is not None:
+        return results
+
+    document = search._doc_type[0]
+    lock_key = f'{key}:lock'
+    if not await cache.aadd(lock_key, True, timeout=SEARCH_LOCK_TIMEOUT):
+        deadline = time.monotonic() + SEARCH_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(SEARCH_LOCK_POLL_INTERVAL)
+            results = await cache.aget(key)
+            if results is not None:
+                return results
+            if await cache.aget(lock_key) is None:  # the other request failed
+                break
+        return SearchResults.from_response(document, await aexecute_search(search))
+
+    try:
+        response = await aexecute_search(search)
+        results = SearchResults.from_response(document, response)
+        if not isinstance(response, LocalResponse):
+            await cache.aset(key, results, timeout=SEARCH_CACHE_TIMEOUT)
+    finally:
+        await cache.adelete(lock_key)
+    return results
@@ -1,45 +1,100 @@
-from django.http import HttpResponse
+import asyncio
+import hashlib
+from functools import lru_cache
+
+from django.http import HttpResponse, JsonResponse
+from django.db.models import Max, Prefetch
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.http import condition, etag
 
 from ecommerce.models import (
     Category,
     Product,
-    ProductInventory
+    ProductInventory,
+    ProductAttributeValue,
 )
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.pagination import LimitOffsetPagination
 from elasticsearch_dsl import Q
 
+from ecommerce.utils import get_cache_version, CATALOG_VERSION_KEY
+
 from search.documents import ProductInventoryDocument
-from search.serializers import CategorySerializer, ProductSerializer, ProductInventorySerializer, \
-    ProductInventorySearchSerializer
+from search.local import LocalResponse
+from search.utils import execute_cached, aexecute_cached, execute_search, normalize_query
+from search.serializers import CategorySerializer, ProductInventorySearchSerializer, serialize_category, \
+    serialize_product, serialize_product_inventory
+
+
+def get_catalog_etag(request, *args, **kwargs) -> str:
+    """ETag of API responses with catalog data - it changes
+       with catalog version, so no query is needed."""
+    return hashlib.md5(f'{get_cache_version(CATALOG_VERSION_KEY)}:{request.get_full_path()}'.encode()).hexdigest()
+
+
+def get_product_inventory_queryset():
+    """ProductInventory queryset with everything serialize_product_inventory needs."""
+    return ProductInventory.objects.select_related('product', 'brand').prefetch_related(
+        'media_product_inventory',
+        Prefetch('attribute_values', queryset=ProductAttributeValue.objects.select_related('product_attribute')),
+    )
+
+
+def get_products_last_modified(request, query=None):
+    return Product.objects.filter(category__slug=query).aggregate(Max('updated_at'))['updated_at__max']
+
+
+def get_product_inventories_last_modified(request, query=None):
+    """The latest change of inventories, their product or images."""
+    dates = ProductInventory.objects.filter(product__web_id=query).aggregate(
+        Max('updated_at'), Max('product__updated_at'), Max('media_product_inventory__updated_at'))
+    return max(filter(None, dates.values()), default=None)
 
 
 class CategoryList(APIView):
     """Return list of all categories."""
 
+    @method_decorator(etag(get_catalog_etag))
     def get(self, request):
-        queryset = Category.objects.all()
-        serializer = CategorySerializer(queryset, many=True)
-        return Response(serializer.data)
+        categories = Category.objects.values('name', 'slug', 'is_active')
+        return Response([serialize_category(category) for category in categories])
 
 
 class ProductByCategory(APIView):
     """Return product by category."""
 
+    @method_decorator(condition(etag_func=get_catalog_etag, last_modified_func=get_products_last_modified))
     def get(self, request, query=None):
-        queryset = Product.objects.filter(category__slug=query)
-        serializer = ProductSerializer(queryset, many=True)
-        return Response(serializer.data)
+        products = Product.objects.filter(category__slug=query).only('name', 'web_id')
+        return Response([serialize_product(product) for product in products])
 
 
 class ProductInventoryByWebId(APIView):
     """Return Sub Product by WebId."""
 
+    @method_decorator(condition(etag_func=get_catalog_etag, last_modified_func=get_product_inventories_last_modified))
     def get(self, request, query=None):
-        queryset = ProductInventory.objects.filter(product__web_id=query)
-        serializer = ProductInventorySerializer(queryset, many=True)
-        return Response(serializer.data)
+        product_inventories = get_product_inventory_queryset().filter(product__web_id=query)
+        return Response([serialize_product_inventory(product_inventory)
+                         for product_inventory in product_inventories])
+
+
+def get_search_query(query):
+    """Full text query of search API - product name, web_id or brand name."""
+    return Q(
+        'multi_match',
+        query=normalize_query(query),
+        fields=['product.name', 'product.web_id', 'brand.name'],
+        fuzziness='auto',
+    ) & Q(
+        should=[
+            Q('match'),
+        ],
+        minimum_should_match=1,
+    )
 
 
 class SearchProductInventory(APIView, LimitOffsetPagination):
@@ -49,24 +104,120 @@ class SearchProductInventory(APIView, LimitOffsetPagination):
 
     def get(self, request, query=None):
         try:
-            q = Q(
-                'multi_match',
-                query=query,
-                fields=['product.name', 'product.web_id', 'brand.name'],
-                fuzziness='auto',
-            ) & Q(
-                should=[
-                    Q('match'),
-                ],
-                minimum_should_match=1,
-            )
-
-            search = self.search_document.search().query(q)
-            response = search.execute()
-
-            results = self.paginate_queryset(response, request, view=self)
-            serializer = self.productinventory_serializer(results, many=True)
+            # only the requested page is fetched from elasticsearch
+            self.request = request
+            self.limit = self.get_limit(request)
+            self.offset = self.get_offset(request)
+            search = self.search_document.search().query(get_search_query(query))[self.offset:self.offset + self.limit]
+            results = execute_cached(search)
+
+            self.count = results.total
+            serializer = self.productinventory_serializer(list(results), many=True)
             return self.get_paginated_response(serializer.data)
 
         except Exception as e:
             return HttpResponse(e, status=500)
+
+
+class AsyncCategoryList(View):
+    """Async version of CategoryList, for serving under ASGI."""
+
+    async def get(self, request):
+        categories = [category async for category in Category.objects.all()]
+        serializer = CategorySerializer(categories, many=True)
+        return JsonResponse(serializer.data, safe=False)
+
+
+class AsyncSearchProductInventory(View):
+    """Async version of SearchProductInventory, for serving under ASGI. It does not
+       block a worker thread while waiting for elasticsearch. Products with
+       SKU or web_id equal to the query are looked up in the database
+       at the same time - they are up to date even before being indexed."""
+    productinventory_serializer = ProductInventorySearchSerializer
+    search_document = ProductInventoryDocument
+    default_limit = 30
+    max_limit = 100
+
+    @staticmethod
+    async def get_exact_matches(query):
+        if not query:
+            return []
+        queryset = ProductInventory.objects.filter(sku__iexact=query) | \
+            ProductInventory.objects.filter(product__web_id__iexact=query)
+        return [product_inventory async for product_inventory in queryset.select_related('product', 'brand')]
+
+    async def get(self, request, query=None):
+        limit, offset = request.GET.get('limit', ''), request.GET.get('offset', '')
+        limit = min(int(limit), self.max_limit) if limit.isdigit() and int(limit) > 0 else self.default_limit
+        offset = int(offset) if offset.isdigit() else 0
+        search = self.search_document.search().query(get_search_query(query))[offset:offset + limit]
+        try:
+            results, exact_matches = await asyncio.gather(
+                aexecute_cached(search), self.get_exact_matches(normalize_query(query)))
+
+        except Exception as e:
+            return HttpResponse(e, status=500)
+
+        return JsonResponse({
+            'count': results.total,
+            'exact_matches': self.productinventory_serializer(exact_matches, many=True).data,
+            'results': self.productinventory_serializer(list(results), many=True).data,
+        })
+
+
+class UncachedSuggestions(Exception):
+    """Raised by get_suggestions with suggestions of the local index,
+       so they are returned, but not kept by lru_cache."""
+
+    def __init__(self, suggestions):
+        self.suggestions = suggestions
+        super().__init__()
+
+
+@lru_cache(maxsize=1024)
+def get_suggestions(prefix: str, size: int, catalog_version: int) -> tuple:
+    """Gets and returns suggestions (text, product name and slug) for 'prefix'
+       from completion suggester. The most frequent prefixes are kept in memory,
+       'catalog_version' is a part of the key, so they are dropped when
+       the catalog changes. Raises UncachedSuggestions if they come from
+       the local index (it can be outdated)."""
+    search = ProductInventoryDocument.search().source(['product.name', 'product.slug']).suggest(
+        'products', prefix, completion={'field': 'suggest', 'size': size, 'skip_duplicates': True})
+    response = execute_search(search)
+    suggestions = tuple(
+        {'text': option.text, 'name': option._source.product.name, 'slug': option._source.product.slug}
+        for option in response.suggest.products[0].options
+    )
+    if isinstance(response, LocalResponse):
+        raise UncachedSuggestions(suggestions)
+    return suggestions
+
+
+class AutocompleteProductInventory(APIView):
+    """APIView for search-as-you-type suggestions. The response contains
+       the query it was made for, so responses to outdated queries
+       can be ignored by the client."""
+    min_prefix_length = 2
+    max_size = 10
+    max_age = 60
+
+    def get(self, request):
+        prefix = ' '.join(request.GET.get('q', '').lower().split())
+        size = request.GET.get('size', '5')
+        size = min(int(size), self.max_size) if size.isdigit() and int(size) > 0 else 5
+
+        cacheable = True
+        if len(prefix) < self.min_prefix_length:
+            suggestions = ()
+        else:
+            try:
+                suggestions = get_suggestions(prefix, size, get_cache_version(CATALOG_VERSION_KEY))
+            except UncachedSuggestions as e:
+                suggestions, cacheable = e.suggestions, False
+            except Exception as e:
+                return HttpResponse(e, status=500)
+
+        response = Response({'query': prefix, 'suggestions': suggestions})
+        if cacheable:
+            patch_cache_control(response, public=True, max_age=self.max_age)
+        return response
@@ -1,9 +1,14 @@
 from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
+from django.core.asgi import get_asgi_application
+
+# before importing anything that uses models
+django_asgi_app = get_asgi_application()
 
 import chats.routing
 
 application = ProtocolTypeRouter({
+    'http': django_asgi_app,
     'websocket': AuthMiddlewareStack(
         URLRouter(
             chats.routing.websocket_urlpatterns
@@ -100,12 +100,38 @@ CHANNEL_LAYERS = {
     }
 }
 
+# cache shared by web processes and workers (management commands) - versions of cached data
+# bumped in one process must be seen by all of them, so local memory cache is used only without redis
+REDIS_URL = config('REDIS_URL', default=None)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 ELASTICSEARCH_DSL = {
     'default': {
         'hosts': 'esearch'
     }
 }
 
+# changes are queued in SearchIndexOutbox and indexed by process_search_outbox command
+ELASTICSEARCH_DSL_SIGNAL_PROCESSOR = 'search.signals.OutboxSignalProcessor'
+
+# search with local in-process index instead of elasticsearch (used anyway when elasticsearch is unavailable)
+SEARCH_LOCAL_ONLY = config('SEARCH_LOCAL_ONLY', default=False, cast=bool)
+
+# sessions (with SessionCartStore carts) are kept in the shared cache - changing them does not write to the database
+SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
+
+# where carts are kept until placing an order - 'ecommerce.cart.SessionCartStore'
+# (written to the database by flush_carts command) or 'ecommerce.cart.DatabaseCartStore'
+CART_STORE = 'ecommerce.cart.SessionCartStore'
+
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
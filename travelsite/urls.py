@@ -6,7 +6,8 @@ from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework import routers
 
-from search.views import SearchProductInventory, CategoryList, ProductByCategory, ProductInventoryByWebId
+from search.views import SearchProductInventory, CategoryList, ProductByCategory, ProductInventoryByWebId, \
+    AutocompleteProductInventory, AsyncCategoryList, AsyncSearchProductInventory
 from . import views
 from search import views as search_views
 
@@ -26,5 +27,10 @@ urlpatterns = [
     ),
     path('api/inventory/<str:query>/', ProductInventoryByWebId.as_view()),
     path('api/search/<str:query>/', SearchProductInventory.as_view(), name='search-api'),
+    path('api/autocomplete/', AutocompleteProductInventory.as_view(), name='autocomplete-api'),
+
+    # async API / Search (for serving under ASGI)
+    path('api/async/inventory/category/all/', AsyncCategoryList.as_view()),
+    path('api/async/search/<str:query>/', AsyncSearchProductInventory.as_view(), name='async-search-api'),
 
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
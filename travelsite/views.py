@@ -1,6 +1,7 @@
 from django.views.generic import TemplateView, FormView
 
 from ecommerce.models import Product, ProductInventory, Media
+from ecommerce.utils import get_random_sample
 
 
 class HomeView(TemplateView):
@@ -10,7 +11,7 @@ class HomeView(TemplateView):
     @staticmethod
     def get_products_data():
         """Return three random products with images."""
-        products = Product.objects.filter(is_active=True).order_by('?')[:3]
+        products = get_random_sample(Product, 3, is_active=True)
         products_data = []
         for product in products:
             product_inventory = ProductInventory.objects.filter(product=product)[0]